@@ -10,7 +10,7 @@ sys.path.append(os.path.dirname(__file__))
 
 from chatmark import Checkbox, Form, TextEditor  # noqa: E402
 from ide_services import IDEService  # noqa: E402
-from llm_api import chat_completion_stream  # noqa: E402
+from llm_api import HedgePolicy, chat_completion_stream, hedging  # noqa: E402
 
 diff_too_large_message_en = (
     "Commit failed. The modified content is too long "
@@ -103,6 +103,10 @@ PROMPT_COMMIT_MESSAGE_BY_DIFF_USER_INPUT = read_prompt_from_file(PROMPT_FILENAME
 prompt_commit_message_by_diff_user_input_llm_config = {
     "model": os.environ.get("LLM_MODEL", "gpt-3.5-turbo-1106")
 }
+# commit message is interactive, hedge requests whose first token is slow to arrive.
+# A fixed delay: this one-shot process makes a single request, so a learned
+# percentile would never get the samples it needs.
+commit_message_hedge_policy = HedgePolicy(delay=3.0)
 
 
 language = ""
@@ -299,7 +303,10 @@ def generate_commit_message_base_diff(user_input, diff):
         sys.exit(0)
 
     messages = [{"role": "user", "content": prompt}]
-    response = chat_completion_stream(messages, prompt_commit_message_by_diff_user_input_llm_config)
+    with hedging(commit_message_hedge_policy):
+        response = chat_completion_stream(
+            messages, prompt_commit_message_by_diff_user_input_llm_config
+        )
 
     if (
         not response["content"]
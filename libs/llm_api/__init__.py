@@ -1,19 +1,83 @@
-from .chat import chat, chat_json
+from .batch import achat_completion_batch, chat_completion_batch, run_batch
+from .cache import ResponseCache, set_response_cache
+from .chat import achat, achat_json, chat, chat_json
+from .circuit import CircuitBreaker, CircuitOpenError, set_circuit_breaker
+from .client import get_client
+from .compaction import ContextPolicy
+from .fallback import FallbackChain, FallbackTier, set_fallback_chain
+from .hedge import HedgePolicy, hedging, set_hedge_policy
+from .instrument import JsonlSink, MemorySink, add_sink, remove_sink
+from .ledger import UsageLedger, enable_ledger
 from .memory.base import ChatMemory
 from .memory.fixsize_memory import FixSizeChatMemory
-from .openai import chat_completion_no_stream_return_json, chat_completion_stream
+from .memory.sqlite_memory import SQLiteChatMemory
+from .memory.token_budget_memory import TokenBudgetChatMemory
+from .openai import (
+    achat_completion_no_stream_return_json,
+    achat_completion_stream,
+    chat_completion_no_stream_return_json,
+    chat_completion_stream,
+    chat_completion_stream_return_json,
+)
+from .pipeline import RetryPolicy, retry_policy, set_retry_policy
+from .pricing import estimate_cost, register_price
+from .ratelimit import RateLimiter, set_rate_limiter
+from .singleflight import set_single_flight
 from .text_confirm import llm_edit_confirm
-from .tools_call import chat_tools, llm_func, llm_param
+from .tool_cache import ToolResultCache, get_tool_cache, set_tool_cache
+from .tools_call import ToolDispatcher, chat_tools, llm_func, llm_param, run_tool_calls
 
 __all__ = [
     "chat_completion_stream",
     "chat_completion_no_stream_return_json",
+    "chat_completion_stream_return_json",
+    "achat_completion_stream",
+    "achat_completion_no_stream_return_json",
     "chat_json",
     "chat",
+    "achat_json",
+    "achat",
     "llm_edit_confirm",
     "llm_func",
     "llm_param",
     "chat_tools",
+    "run_tool_calls",
+    "ContextPolicy",
+    "ToolDispatcher",
+    "ToolResultCache",
+    "get_tool_cache",
+    "set_tool_cache",
     "ChatMemory",
     "FixSizeChatMemory",
+    "TokenBudgetChatMemory",
+    "SQLiteChatMemory",
+    "get_client",
+    "RetryPolicy",
+    "retry_policy",
+    "set_retry_policy",
+    "ResponseCache",
+    "set_response_cache",
+    "set_single_flight",
+    "RateLimiter",
+    "set_rate_limiter",
+    "chat_completion_batch",
+    "achat_completion_batch",
+    "run_batch",
+    "add_sink",
+    "remove_sink",
+    "JsonlSink",
+    "MemorySink",
+    "HedgePolicy",
+    "hedging",
+    "set_hedge_policy",
+    "CircuitBreaker",
+    "CircuitOpenError",
+    "set_circuit_breaker",
+    "FallbackChain",
+    "FallbackTier",
+    "set_fallback_chain",
+    "UsageLedger",
+    "enable_ledger",
+    "estimate_cost",
+    "register_price",
 ]
@@ -0,0 +1,77 @@
+import asyncio
+import inspect
+from typing import Dict, Optional
+
+from .pipeline import RetryPolicy, RetryState
+
+
+async def _resolve(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def aiterate(chunks):
+    """
+    Iterate over a sync or async iterable from async code.
+    """
+    if hasattr(chunks, "__aiter__"):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
+
+
+def async_retry(func, times, policy: Optional[RetryPolicy] = None):
+    async def wrapper(*args, **kwargs):
+        state = RetryState(times, policy)
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as err:
+                await asyncio.sleep(state.next_delay(err))
+
+    return wrapper
+
+
+def async_exception_handle(func, handler):
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except Exception as err:
+            return handler(err)
+
+    return wrapper
+
+
+def async_pipeline(*funcs):
+    """
+    Async version of pipeline: each stage may be a plain function, a coroutine
+    function or return an async iterator for the next stage to consume.
+    """
+
+    async def wrapper(*args, **kwargs):
+        for index, func in enumerate(funcs):
+            if index > 0:
+                if isinstance(args, Dict) and args.get("__type__", None) == "parallel":
+                    args = await _resolve(func(*args["value"]))
+                else:
+                    args = await _resolve(func(args))
+            else:
+                args = await _resolve(func(*args, **kwargs))
+        return args
+
+    return wrapper
+
+
+def async_parallel(*funcs):
+    """
+    Run several stages over the same (materialized) input concurrently.
+    """
+
+    async def wrapper(args):
+        values = await asyncio.gather(*[_resolve(func(args)) for func in funcs])
+        return {"__type__": "parallel", "value": list(values)}
+
+    return wrapper
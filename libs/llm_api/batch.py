@@ -0,0 +1,77 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List
+
+from .openai import achat_completion_stream, chat_completion_stream, error_result
+
+
+def run_batch(
+    func: Callable,
+    items: Iterable,
+    max_concurrency: int = 4,
+    error_handler: Callable = lambda err: err,
+) -> List:
+    """
+    Call func(item) for every item on a bounded thread pool.
+
+    Results are returned in input order; an item whose call raises gets
+    error_handler(err) in its slot instead of failing the whole batch.
+    Every call runs in a copy of the caller's context, so settings scoped with
+    use_endpoint, retry_policy, hedging etc. apply to it.
+    """
+
+    def call(item):
+        try:
+            return func(item)
+        except Exception as err:
+            return error_handler(err)
+
+    items = list(items)
+    if max_concurrency <= 1 or len(items) <= 1:
+        return [call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(items))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, call, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def chat_completion_batch(
+    list_of_messages: List[List[Dict]],
+    llm_config: Dict,
+    max_concurrency: int = 4,
+    completion: Callable = chat_completion_stream,
+) -> List[Dict]:
+    """
+    Run independent completions concurrently, results are in input order.
+
+    completion is any prebuilt pipeline (chat_completion_stream by default), so
+    retry and exception_handle behave as for a single call: a failed item
+    gets its error dict while the others succeed.
+    """
+    return run_batch(
+        lambda messages: completion(messages, llm_config=llm_config),
+        list_of_messages,
+        max_concurrency=max_concurrency,
+        error_handler=error_result,
+    )
+
+
+async def achat_completion_batch(
+    list_of_messages: List[List[Dict]],
+    llm_config: Dict,
+    max_concurrency: int = 4,
+    completion: Callable = achat_completion_stream,
+) -> List[Dict]:
+    """
+    Async version of chat_completion_batch on the current event loop.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def call(messages):
+        async with semaphore:
+            try:
+                return await completion(messages, llm_config=llm_config)
+            except Exception as err:
+                return error_result(err)
+
+    return await asyncio.gather(*[call(messages) for messages in list_of_messages])
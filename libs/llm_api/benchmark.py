@@ -0,0 +1,267 @@
+import argparse
+import contextlib
+import contextvars
+import io
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from openai.types.chat import ChatCompletionChunk
+
+from .cache import ResponseCache, get_response_cache, set_response_cache
+from .chat import chat, chat_json
+from .client import use_endpoint
+from .mock_server import MockConfig, MockLLMServer, stream_chunks
+from .openai import (
+    chat_call_completion_stream,
+    chat_completion_no_stream_return_json,
+    chat_completion_stream,
+    chunk_list,
+    chunks_call,
+    chunks_content,
+    chunks_content_and_call,
+    stream_out_chunk,
+)
+from .pipeline import RetryPolicy, parallel, pipeline, retry_policy
+
+MESSAGES = [{"role": "user", "content": "benchmark"}]
+TOOL_CALLS = [
+    {"name": "get_weather", "arguments": '{"city": "Paris", "unit": "celsius", "days": 3}'},
+    {"name": "get_time", "arguments": '{"timezone": "Europe/Paris"}'},
+]
+
+
+def make_chunks(content_chars: int, chunk_size: int, tool_calls: bool) -> List[ChatCompletionChunk]:
+    """
+    Parsed chunks of a synthetic stream, as the OpenAI client would yield them.
+    """
+    config = MockConfig(
+        content="x" * content_chars,
+        tool_calls=TOOL_CALLS if tool_calls else None,
+        chunk_size=chunk_size,
+    )
+    body = {"model": "mock-model", "stream": True}
+    return [ChatCompletionChunk.model_validate(c) for c in stream_chunks(config, body)]
+
+
+def _drain(chunks):
+    for _ in chunks:
+        pass
+
+
+STAGES: Dict[str, Callable] = {
+    "iterate (baseline)": _drain,
+    "stream_out_chunk": lambda chunks: _drain(stream_out_chunk(chunks)),
+    "chunks_content": chunks_content,
+    "chunks_call": chunks_call,
+    "parallel(content, call)": pipeline(chunk_list, parallel(chunks_content, chunks_call)),
+    "chunks_content_and_call": chunks_content_and_call,
+}
+
+
+def bench_stages(chunks: List[ChatCompletionChunk], repeat: int) -> List[Dict]:
+    """
+    Per-chunk cost of each stream stage over an in-memory stream.
+    """
+    rows = []
+    for name, stage in STAGES.items():
+        samples = []
+        for _ in range(repeat):
+            # stream_out prints, keep the terminal out of the measurement
+            with contextlib.redirect_stdout(io.StringIO()):
+                started = time.perf_counter()
+                stage(iter(chunks))
+                samples.append(time.perf_counter() - started)
+        best = min(samples)
+        rows.append(
+            {
+                "stage": name,
+                "us_per_chunk": best / len(chunks) * 1e6,
+                "median_ms": statistics.median(samples) * 1000,
+            }
+        )
+    return rows
+
+
+def _timed_calls(func: Callable, calls: int) -> Dict:
+    latencies = []
+    failures = 0
+    for _ in range(calls):
+        started = time.perf_counter()
+        result = func(MESSAGES, llm_config={"model": "mock-model"})
+        latencies.append(time.perf_counter() - started)
+        if not isinstance(result, dict) or "error" in result:
+            failures += 1
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "failures": failures,
+    }
+
+
+def bench_server(calls: int, chunk_size: int, content_chars: int) -> List[Dict]:
+    """
+    End to end calls against the mock server, clean and with injected faults.
+    """
+    scenarios = [
+        ("clean", MockConfig(), chat_completion_stream),
+        ("tool calls", MockConfig(tool_calls=TOOL_CALLS), chat_call_completion_stream),
+        ("500 x2 then ok", MockConfig(fail_times=2), chat_completion_stream),
+        (
+            "429 retry-after",
+            MockConfig(fail_times=1, error_status=429, retry_after=0.05),
+            chat_completion_stream,
+        ),
+        ("stall > timeout", MockConfig(stall=0.3), chat_completion_stream),
+    ]
+    # short fixed delays so the benchmark measures retry overhead, not backoff
+    policy = RetryPolicy(base_delay=0.01, max_delay=0.1, jitter=False, max_total_time=10)
+    rows = []
+    with MockLLMServer() as server:
+        with use_endpoint("sk-mock", server.base_url), retry_policy(policy):
+            for name, config, func in scenarios:
+                config.content = "x" * content_chars
+                config.chunk_size = chunk_size
+                server.config = config
+                timeout = 0.2 if config.stall else 60
+
+                def call(messages, llm_config, func=func, timeout=timeout):
+                    # faults fire on the first requests of each call, not only of the run
+                    server.reset()
+                    return func(messages, llm_config={**llm_config, "timeout": timeout})
+
+                with contextlib.redirect_stderr(io.StringIO()):
+                    stats = _timed_calls(call, 1 if config.stall else calls)
+                rows.append({"scenario": name, **stats, "requests_last_call": server.request_count})
+    return rows
+
+
+def bench_cache(calls: int) -> List[Dict]:
+    """
+    Repeat identical calls with a response cache, only the first one of each
+    pipeline should reach the mock server.
+    """
+    scenarios = [
+        ("chat_completion_stream", "cached answer", chat_completion_stream),
+        (
+            "chat_completion_no_stream_return_json",
+            'Result:\n```json\n{"cached": true}\n```\nDone.',
+            chat_completion_no_stream_return_json,
+        ),
+    ]
+    previous = get_response_cache()
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as path, MockLLMServer() as server:
+            set_response_cache(ResponseCache(path))
+            with use_endpoint("sk-mock", server.base_url):
+                for name, content, func in scenarios:
+                    server.config = MockConfig(content=content)
+                    server.reset()
+                    results = [
+                        func(MESSAGES, llm_config={"model": f"mock-{name}"}) for _ in range(calls)
+                    ]
+                    rows.append(
+                        {
+                            "pipeline": name,
+                            "calls": calls,
+                            "requests": server.request_count,
+                            "same_result": all(result == results[0] for result in results),
+                        }
+                    )
+    finally:
+        set_response_cache(previous)
+    return rows
+
+
+def bench_concurrency(calls: int, workers: int) -> List[Dict]:
+    """
+    Call decorated chat functions from a thread pool against an echoing mock
+    server and count the calls that did not get their own answer back.
+    """
+
+    @chat("echo {n}", model="mock-model")
+    def echo(n):
+        pass
+
+    @chat_json('{{"n": {n}}}', model="mock-model")
+    def echo_json(n):
+        pass
+
+    shared_config = {"model": "mock-model"}
+    scenarios = [
+        ("chat", echo, lambda n, result: result == f"echo {n}"),
+        ("chat_json", echo_json, lambda n, result: result == {"n": n}),
+        (
+            "shared llm_config",
+            lambda n: chat_completion_stream(
+                [{"role": "user", "content": f"echo {n}"}], llm_config=shared_config
+            ),
+            lambda n, result: (
+                result["content"] == f"echo {n}" and shared_config == {"model": "mock-model"}
+            ),
+        ),
+    ]
+    rows = []
+    with MockLLMServer(MockConfig(echo=True)) as server:
+        with use_endpoint("sk-mock", server.base_url):
+            for name, func, check in scenarios:
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    # threads do not inherit context variables such as use_endpoint()
+                    futures = [
+                        executor.submit(contextvars.copy_context().run, func, n=n)
+                        for n in range(calls)
+                    ]
+                    results = [future.result() for future in futures]
+                elapsed = time.perf_counter() - started
+                wrong = sum(1 for n, result in enumerate(results) if not check(n, result))
+                rows.append(
+                    {
+                        "scenario": name,
+                        "calls": calls,
+                        "workers": workers,
+                        "calls_per_s": calls / elapsed,
+                        "wrong": wrong,
+                    }
+                )
+    return rows
+
+
+def _print_rows(title: str, rows: List[Dict]):
+    print(f"\n{title}")
+    columns = list(rows[0].keys())
+    cells = [[f"{v:.2f}" if isinstance(v, float) else str(v) for v in r.values()] for r in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m llm_api.benchmark",
+        description="Offline benchmark of llm_api stream stages and retries.",
+    )
+    parser.add_argument("--chars", type=int, default=4000, help="content length per response")
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=20, help="calls per server scenario")
+    parser.add_argument("--workers", type=int, default=16, help="threads of the stress test")
+    parser.add_argument("--no-server", action="store_true", help="only benchmark the stages")
+    args = parser.parse_args(argv)
+
+    for tool_calls in (False, True):
+        chunks = make_chunks(args.chars, args.chunk_size, tool_calls)
+        title = f"stages, {len(chunks)} chunks" + (" with tool calls" if tool_calls else "")
+        _print_rows(title, bench_stages(chunks, args.repeat))
+    if not args.no_server:
+        _print_rows("mock server", bench_server(args.calls, args.chunk_size, args.chars))
+        _print_rows("response cache", bench_cache(3))
+        _print_rows("concurrent decorated calls", bench_concurrency(args.calls * 10, args.workers))
+
+
+if __name__ == "__main__":
+    main()
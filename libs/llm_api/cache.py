@@ -0,0 +1,215 @@
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from openai.types.chat import ChatCompletionChunk
+
+from .client import current_endpoint
+
+# llm_config keys that change the model output, all others (timeout, stream, ...) are ignored
+CACHE_CONFIG_KEYS = (
+    "model",
+    "temperature",
+    "top_p",
+    "max_tokens",
+    "stop",
+    "seed",
+    "n",
+    "presence_penalty",
+    "frequency_penalty",
+    "tools",
+    "tool_choice",
+    "functions",
+    "function_call",
+    "response_format",
+)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".chat", "cache", "llm_responses")
+
+
+def request_key(messages: List[Dict], llm_config: Dict) -> str:
+    """
+    Return a stable hash of messages, the output-relevant part of llm_config and
+    the endpoint the request goes to, so a response of one provider (or fallback
+    tier) is never served for another.
+    """
+    _, base_url = current_endpoint()
+    payload = {
+        "endpoint": base_url or "https://api.openai.com/v1",
+        "messages": messages,
+        "config": {key: llm_config[key] for key in CACHE_CONFIG_KEYS if key in llm_config},
+    }
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _chunk_to_dict(chunk) -> Dict:
+    if hasattr(chunk, "model_dump"):
+        return chunk.model_dump(exclude_none=True)
+    return chunk.dict(exclude_none=True)
+
+
+class ResponseCache:
+    """
+    ResponseCache stores streamed responses on disk, one JSON file per request key.
+
+    Entries expire after ttl seconds; when max_entries or max_bytes is exceeded the
+    least recently used entries (by file mtime, refreshed on every hit) are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_DIR,
+        max_entries: int = 512,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: Optional[float] = 7 * 24 * 3600,
+    ):
+        self._path = path
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self._path, f"{key}.json")
+
+    def get(self, key: str) -> Optional[List[Dict]]:
+        """
+        Return the recorded chunks for key, or None on a miss.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            if self._ttl is not None and time.time() - os.path.getmtime(entry_path) > self._ttl:
+                os.remove(entry_path)
+                return None
+            with open(entry_path, "r", encoding="utf-8") as f:
+                chunks = json.load(f)
+            # refresh mtime so eviction is least-recently-used
+            os.utime(entry_path)
+            return chunks
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, chunks: List[Dict]):
+        entry_path = self._entry_path(key)
+        tmp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(chunks, f, ensure_ascii=False)
+        os.replace(tmp_path, entry_path)
+        self._evict()
+
+    def discard(self, key: str):
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for entry in self.entries():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def entries(self) -> List[os.DirEntry]:
+        """
+        Return cache entries, least recently used first.
+        """
+        entries = [e for e in os.scandir(self._path) if e.name.endswith(".json")]
+        return sorted(entries, key=lambda e: e.stat().st_mtime)
+
+    def _evict(self):
+        with self._lock:
+            entries = self.entries()
+            now = time.time()
+            total = sum(e.stat().st_size for e in entries)
+            for index, entry in enumerate(entries):
+                expired = self._ttl is not None and now - entry.stat().st_mtime > self._ttl
+                too_many = len(entries) - index > self._max_entries
+                if not (expired or too_many or total > self._max_bytes):
+                    break
+                total -= entry.stat().st_size
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+_response_cache: Optional[ResponseCache] = None
+if os.environ.get("DEVCHAT_LLM_CACHE", "") in ("1", "true"):
+    _response_cache = ResponseCache(os.environ.get("DEVCHAT_LLM_CACHE_DIR", DEFAULT_CACHE_DIR))
+# key of the response most recently served in this context, see discard_current_response
+_current_key: contextvars.ContextVar = contextvars.ContextVar("llm_cache_key", default=None)
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _response_cache
+
+
+def set_response_cache(cache: Optional[ResponseCache]):
+    """
+    Enable (or, with None, disable) response caching for all pipelines.
+    """
+    global _response_cache
+    _response_cache = cache
+
+
+def replay_chunks(chunk_dicts: List[Dict]):
+    """
+    Replay cached chunks as ChatCompletionChunk objects for the downstream stages.
+    """
+    for chunk_dict in chunk_dicts:
+        yield ChatCompletionChunk(**chunk_dict)
+
+
+def lookup_response(messages: List[Dict], llm_config: Dict):
+    """
+    Return (key, cached chunk dicts or None) and remember key for this context.
+    """
+    key = request_key(messages, llm_config)
+    _current_key.set(key)
+    return key, _response_cache.get(key)
+
+
+def discard_current_response():
+    """
+    Drop the entry of the response being processed, e.g. when its content turns
+    out to be unusable, so that a retry goes upstream instead of replaying it.
+    """
+    key = _current_key.get()
+    if _response_cache is not None and key is not None:
+        _response_cache.discard(key)
+
+
+def record_chunks(chunks: Iterable, cache: ResponseCache, key: str):
+    """
+    Pass chunks through and store them once the stream has completed.
+    Streams that fail or are closed early are not cached.
+    """
+    recorded = []
+    try:
+        for chunk in chunks:
+            recorded.append(_chunk_to_dict(chunk))
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+    cache.put(key, recorded)
+
+
+async def arecord_chunks(chunks, cache: ResponseCache, key: str):
+    recorded = []
+    try:
+        async for chunk in chunks:
+            recorded.append(_chunk_to_dict(chunk))
+            yield chunk
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+    cache.put(key, recorded)
@@ -1,73 +1,253 @@
 import json
 import os
 import sys
-from functools import wraps
-
-import openai
+from functools import partial, wraps
 
+from .async_pipeline import async_exception_handle, async_pipeline, async_retry
+from .fallback import afallback, fallback
+from .instrument import ainstrument, instrument, instrument_stream
 from .memory.base import ChatMemory
 from .openai import (
+    achat_completion_no_stream_return_json,
+    achat_completion_stream,
+    achat_completion_stream_commit,
+    achunks_content_and_call,
+    aretry_timeout,
+    astop_after_code_block,
     chat_completion_no_stream_return_json,
     chat_completion_stream,
     chat_completion_stream_commit,
-    chunks_content,
+    chunk_delta,
+    chunks_content_and_call,
+    close_chunks,
+    error_reason,
+    error_result,
+    prefetch_first_chunk,
     retry_timeout,
-    stream_out_chunk,
+    stop_after_code_block,
     to_dict_content_and_call,
 )
-from .pipeline import exception_handle, pipeline, retry
+from .pipeline import RetryException, exception_handle, pipeline, retry
 
 chat_completion_stream_out = exception_handle(
-    retry(
-        pipeline(
-            chat_completion_stream_commit,
-            retry_timeout,
-            stream_out_chunk,
-            chunks_content,
-            to_dict_content_and_call,
-        ),
-        times=3,
+    fallback(
+        instrument(
+            retry(
+                pipeline(
+                    chat_completion_stream_commit,
+                    retry_timeout,
+                    partial(chunks_content_and_call, stream_out=True),
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "chat_completion_stream_out",
+        )
+    ),
+    error_result,
+)
+
+achat_completion_stream_out = async_exception_handle(
+    afallback(
+        ainstrument(
+            async_retry(
+                async_pipeline(
+                    achat_completion_stream_commit,
+                    aretry_timeout,
+                    partial(achunks_content_and_call, stream_out=True),
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "achat_completion_stream_out",
+        )
     ),
-    lambda err: {
-        "content": None,
-        "function_name": None,
-        "parameters": "",
-        "error": err.type if isinstance(err, openai.APIError) else err,
-    },
+    error_result,
 )
 
+chat_completion_code_block = exception_handle(
+    fallback(
+        instrument(
+            retry(
+                pipeline(
+                    chat_completion_stream_commit,
+                    retry_timeout,
+                    stop_after_code_block,
+                    chunks_content_and_call,
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "chat_completion_code_block",
+        )
+    ),
+    error_result,
+)
+
+chat_completion_code_block_out = exception_handle(
+    fallback(
+        instrument(
+            retry(
+                pipeline(
+                    chat_completion_stream_commit,
+                    retry_timeout,
+                    stop_after_code_block,
+                    partial(chunks_content_and_call, stream_out=True),
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "chat_completion_code_block_out",
+        )
+    ),
+    error_result,
+)
+
+achat_completion_code_block = async_exception_handle(
+    afallback(
+        ainstrument(
+            async_retry(
+                async_pipeline(
+                    achat_completion_stream_commit,
+                    aretry_timeout,
+                    astop_after_code_block,
+                    achunks_content_and_call,
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "achat_completion_code_block",
+        )
+    ),
+    error_result,
+)
+
+achat_completion_code_block_out = async_exception_handle(
+    afallback(
+        ainstrument(
+            async_retry(
+                async_pipeline(
+                    achat_completion_stream_commit,
+                    aretry_timeout,
+                    astop_after_code_block,
+                    partial(achunks_content_and_call, stream_out=True),
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "achat_completion_code_block_out",
+        )
+    ),
+    error_result,
+)
+
+# the raw chunks for chat(stream=True); connecting and the first read are
+# retried, later failures end the stream since its deltas were already handed out
+chat_completion_stream_chunks = instrument_stream(
+    fallback(
+        retry(
+            pipeline(chat_completion_stream_commit, retry_timeout, prefetch_first_chunk),
+            times=3,
+        )
+    ),
+    "chat_completion_stream_chunks",
+)
+
+
+def _stream_deltas(
+    name, messages, config, memory, user_prompt, stream_out: bool, code_block_only: bool
+):
+    chunks = chat_completion_stream_chunks(messages, llm_config=config)
+    if code_block_only:
+        chunks = stop_after_code_block(chunks)
+    contents = []
+    try:
+        for chunk in chunks:
+            content, _ = chunk_delta(chunk)
+            if content:
+                if stream_out:
+                    print(content, end="", flush=True)
+                contents.append(content)
+                yield content
+    except Exception as err:
+        err = err.error if isinstance(err, RetryException) else err
+        print(
+            f"call {name} failed:",
+            error_reason(err),
+            file=sys.stderr,
+        )
+        return
+    finally:
+        close_chunks(chunks)
+
+    if memory and contents:
+        memory.append(
+            {"role": "user", "content": user_prompt},
+            {"role": "assistant", "content": "".join(contents)},
+        )
+
 
 def chat(
     prompt,
     memory: ChatMemory = None,
     stream_out: bool = False,
     model: str = os.environ.get("LLM_MODEL", "gpt-3.5-turbo-1106"),
+    stop_after_code_block: bool = False,
+    stream: bool = False,
     **llm_config,
 ):
+    """
+    Decorate func to call the LLM with prompt formatted by its keyword arguments.
+
+    With stop_after_code_block the stream is closed as soon as the first fenced
+    code block of the answer is complete, for callers that only keep that block.
+
+    With stream the decorated function returns an iterator of content deltas
+    instead of the final string. The request is sent when iteration starts, a
+    failure ends the iterator (after printing the error) and memory is updated
+    once the answer is complete.
+
+    The decorated function is reentrant: every call keeps its prompt and config
+    in locals, so it may run from several threads (or, for achat, tasks) at once.
+    A memory shared by such calls must be thread-safe, as FixSizeChatMemory is.
+    """
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            nonlocal prompt, memory, model, llm_config
-            prompt = prompt.format(**kwargs)
+            user_prompt = prompt.format(**kwargs)
             messages = memory.contexts() if memory else []
-            if not any(item["content"] == prompt for item in messages) and prompt:
-                messages.append({"role": "user", "content": prompt})
+            if user_prompt and not (memory and memory.contains(user_prompt)):
+                messages.append({"role": "user", "content": user_prompt})
             if "__user_request__" in kwargs:
                 messages.append(kwargs["__user_request__"])
                 del kwargs["__user_request__"]
 
-            llm_config["model"] = model
-            if not stream_out:
-                response = chat_completion_stream(messages, llm_config=llm_config)
+            config = {**llm_config, "model": model}
+            if stream:
+                return _stream_deltas(
+                    func.__name__,
+                    messages,
+                    config,
+                    memory,
+                    user_prompt,
+                    stream_out,
+                    stop_after_code_block,
+                )
+            if stop_after_code_block:
+                completion = (
+                    chat_completion_code_block_out if stream_out else chat_completion_code_block
+                )
             else:
-                response = chat_completion_stream_out(messages, llm_config=llm_config)
+                completion = chat_completion_stream_out if stream_out else chat_completion_stream
+            response = completion(messages, llm_config=config)
             if not response.get("content", None):
                 print(f"call {func.__name__} failed:", response["error"], file=sys.stderr)
                 return None
 
             if memory:
                 memory.append(
-                    {"role": "user", "content": prompt},
+                    {"role": "user", "content": user_prompt},
                     {"role": "assistant", "content": response["content"]},
                 )
             return response["content"]
@@ -86,20 +266,101 @@ def chat_json(
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            nonlocal prompt, memory, model, llm_config
-            prompt = prompt.format(**kwargs)
+            user_prompt = prompt.format(**kwargs)
+            messages = memory.contexts() if memory else []
+            if not (memory and memory.contains(user_prompt)):
+                messages.append({"role": "user", "content": user_prompt})
+
+            config = {**llm_config, "model": model}
+            response = chat_completion_no_stream_return_json(messages, llm_config=config)
+            if not response:
+                print(f"call {func.__name__} failed.", file=sys.stderr)
+
+            if memory:
+                memory.append(
+                    {"role": "user", "content": user_prompt},
+                    {"role": "assistant", "content": json.dumps(response)},
+                )
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def achat(
+    prompt,
+    memory: ChatMemory = None,
+    stream_out: bool = False,
+    model: str = os.environ.get("LLM_MODEL", "gpt-3.5-turbo-1106"),
+    stop_after_code_block: bool = False,
+    **llm_config,
+):
+    """
+    Async version of chat, the decorated function becomes a coroutine function.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            user_prompt = prompt.format(**kwargs)
+            messages = memory.contexts() if memory else []
+            if user_prompt and not (memory and memory.contains(user_prompt)):
+                messages.append({"role": "user", "content": user_prompt})
+            if "__user_request__" in kwargs:
+                messages.append(kwargs["__user_request__"])
+                del kwargs["__user_request__"]
+
+            config = {**llm_config, "model": model}
+            if stop_after_code_block:
+                completion = (
+                    achat_completion_code_block_out if stream_out else achat_completion_code_block
+                )
+            else:
+                completion = achat_completion_stream_out if stream_out else achat_completion_stream
+            response = await completion(messages, llm_config=config)
+            if not response.get("content", None):
+                print(f"call {func.__name__} failed:", response["error"], file=sys.stderr)
+                return None
+
+            if memory:
+                memory.append(
+                    {"role": "user", "content": user_prompt},
+                    {"role": "assistant", "content": response["content"]},
+                )
+            return response["content"]
+
+        return wrapper
+
+    return decorator
+
+
+def achat_json(
+    prompt,
+    memory: ChatMemory = None,
+    model: str = os.environ.get("LLM_MODEL", "gpt-3.5-turbo-1106"),
+    **llm_config,
+):
+    """
+    Async version of chat_json.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            user_prompt = prompt.format(**kwargs)
             messages = memory.contexts() if memory else []
-            if not any(item["content"] == prompt for item in messages):
-                messages.append({"role": "user", "content": prompt})
+            if not (memory and memory.contains(user_prompt)):
+                messages.append({"role": "user", "content": user_prompt})
 
-            llm_config["model"] = model
-            response = chat_completion_no_stream_return_json(messages, llm_config=llm_config)
+            config = {**llm_config, "model": model}
+            response = await achat_completion_no_stream_return_json(messages, llm_config=config)
             if not response:
                 print(f"call {func.__name__} failed.", file=sys.stderr)
 
             if memory:
                 memory.append(
-                    {"role": "user", "content": prompt},
+                    {"role": "user", "content": user_prompt},
                     {"role": "assistant", "content": json.dumps(response)},
                 )
             return response
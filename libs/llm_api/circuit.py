@@ -0,0 +1,168 @@
+import os
+import time
+from typing import Optional, Sequence
+
+from .client import current_endpoint
+from .file_lock import LockedJSONState
+
+DEFAULT_STATE_PATH = os.path.join(os.path.expanduser("~"), ".chat", "cache", "llm_circuit.json")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an endpoint whose circuit is open.
+    """
+
+    def __init__(self, scope: str, retry_in: float):
+        super().__init__(f"circuit open for {scope}, next probe in {retry_in:.0f}s")
+        self.scope = scope
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    CircuitBreaker stops calling an endpoint (base_url + model) after
+    failure_threshold failures within window seconds.
+
+    While open, calls fail at once with CircuitOpenError. After cooldown
+    seconds one half-open probe request is let through: its success closes
+    the circuit, its failure opens it for another cooldown. State lives in a
+    JSON file guarded by a file lock, so every workflow process sees it.
+    """
+
+    TRIP_ON = ("timeout", "connection", "server")
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        window: float = 60.0,
+        cooldown: float = 30.0,
+        trip_on: Sequence[str] = TRIP_ON,
+        path: str = DEFAULT_STATE_PATH,
+    ):
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.trip_on = tuple(trip_on)
+        self._state = LockedJSONState(path)
+
+    def state(self, scope: str) -> str:
+        with self._state:
+            return self._state.read().get(scope, {}).get("state", CLOSED)
+
+    def before_call(self, scope: str):
+        """
+        Raise CircuitOpenError if scope must not be called now. A call let
+        through after the cooldown becomes the half-open probe.
+        """
+        with self._state:
+            state = self._state.read()
+            circuit = state.get(scope)
+            if not circuit or circuit["state"] == CLOSED:
+                return
+
+            now = time.time()
+            # an open circuit and a probe that never reported both expire after cooldown
+            since = circuit["opened_at"] if circuit["state"] == OPEN else circuit["probe_at"]
+            if now < since + self.cooldown:
+                raise CircuitOpenError(scope, since + self.cooldown - now)
+            circuit["state"] = HALF_OPEN
+            circuit["probe_at"] = now
+            self._state.write(state)
+
+    def record_success(self, scope: str):
+        with self._state:
+            state = self._state.read()
+            if scope not in state:
+                return
+            del state[scope]
+            self._state.write(state)
+
+    def record_failure(self, scope: str, kind: str):
+        if kind not in self.trip_on:
+            # e.g. a 400 or a rate limit, neither health nor failure of the endpoint
+            return
+        with self._state:
+            state = self._state.read()
+            now = time.time()
+            circuit = state.setdefault(scope, {"state": CLOSED, "failures": []})
+            failures = [t for t in circuit.get("failures", []) if t > now - self.window]
+            failures.append(now)
+            circuit["failures"] = failures
+            if circuit["state"] == HALF_OPEN or len(failures) >= self.failure_threshold:
+                circuit["state"] = OPEN
+                circuit["opened_at"] = now
+            self._state.write(state)
+
+    def reset(self, scope: Optional[str] = None):
+        """
+        Close the circuit of scope, or of every endpoint.
+        """
+        with self._state:
+            state = self._state.read()
+            if scope is None:
+                state = {}
+            else:
+                state.pop(scope, None)
+            self._state.write(state)
+
+
+def circuit_scope(model: Optional[str]) -> str:
+    """
+    Circuit key of the current endpoint and model.
+    """
+    _, base_url = current_endpoint()
+    return f"{base_url or 'https://api.openai.com/v1'}|{model or ''}"
+
+
+def _close(chunks):
+    close = getattr(chunks, "close", None)
+    if close:
+        close()
+
+
+def guard_chunks(chunks, breaker: CircuitBreaker, scope: str, classify):
+    """
+    Pass chunks through, recording a failure of the stream as a circuit failure.
+    """
+    try:
+        for chunk in chunks:
+            yield chunk
+    except Exception as err:
+        breaker.record_failure(scope, classify(err))
+        raise
+    finally:
+        _close(chunks)
+
+
+async def aguard_chunks(chunks, breaker: CircuitBreaker, scope: str, classify):
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except Exception as err:
+        breaker.record_failure(scope, classify(err))
+        raise
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+
+
+_circuit_breaker: Optional[CircuitBreaker] = None
+if os.environ.get("DEVCHAT_LLM_CIRCUIT_BREAKER", "") in ("1", "true"):
+    _circuit_breaker = CircuitBreaker()
+
+
+def get_circuit_breaker() -> Optional[CircuitBreaker]:
+    return _circuit_breaker
+
+
+def set_circuit_breaker(breaker: Optional[CircuitBreaker]):
+    """
+    Install (or, with None, remove) the circuit breaker checked before every upstream call.
+    """
+    global _circuit_breaker
+    _circuit_breaker = breaker
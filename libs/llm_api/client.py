@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import os
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import openai
+
+_clients: Dict[Tuple, openai.OpenAI] = {}
+_clients_lock = threading.Lock()
+# async clients hold loop-bound connections, so they are pooled per event loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = (
+    weakref.WeakKeyDictionary()
+)
+_endpoint: contextvars.ContextVar = contextvars.ContextVar("llm_endpoint", default=(None, None))
+
+
+def current_endpoint() -> Tuple[Optional[str], Optional[str]]:
+    """
+    Return the (api_key, base_url) used by clients created without explicit values.
+    """
+    api_key, base_url = _endpoint.get()
+    return (
+        api_key or os.environ.get("OPENAI_API_KEY", None),
+        base_url or os.environ.get("OPENAI_API_BASE", None),
+    )
+
+
+@contextmanager
+def use_endpoint(api_key: Optional[str] = None, base_url: Optional[str] = None):
+    """
+    Send the completions made inside the with block to another endpoint.
+    Values left as None keep those of the enclosing block.
+    """
+    outer_api_key, outer_base_url = _endpoint.get()
+    token = _endpoint.set((api_key or outer_api_key, base_url or outer_base_url))
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+
+def get_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    max_retries: Optional[int] = None,
+) -> openai.OpenAI:
+    """
+    Return the process-wide OpenAI client for api_key/base_url.
+
+    Clients are created once per key pair and then reused, so every pipeline
+    shares the same keep-alive connection pool instead of paying a new TCP/TLS
+    handshake on each call. Missing values fall back to use_endpoint() or to
+    OPENAI_API_KEY and OPENAI_API_BASE. A client with a different max_retries is derived from
+    the pooled one and shares its connections.
+    """
+    default_api_key, default_base_url = current_endpoint()
+    api_key = api_key or default_api_key
+    base_url = base_url or default_base_url
+    key = (api_key, base_url, max_retries)
+
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients.get((api_key, base_url, None))
+            if client is None:
+                client = openai.OpenAI(api_key=api_key, base_url=base_url)
+                _clients[(api_key, base_url, None)] = client
+            if max_retries is not None:
+                client = client.with_options(max_retries=max_retries)
+            _clients[key] = client
+        return client
+
+
+def get_async_client(
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    max_retries: Optional[int] = None,
+) -> openai.AsyncOpenAI:
+    """
+    Return the AsyncOpenAI client for api_key/base_url on the running event loop.
+    """
+    default_api_key, default_base_url = current_endpoint()
+    api_key = api_key or default_api_key
+    base_url = base_url or default_base_url
+    key = (api_key, base_url, max_retries)
+
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = clients.get((api_key, base_url, None))
+            if client is None:
+                client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url)
+                clients[(api_key, base_url, None)] = client
+            if max_retries is not None:
+                client = client.with_options(max_retries=max_retries)
+            clients[key] = client
+        return client
+
+
+def close_clients():
+    """
+    Close all pooled clients and forget them.
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
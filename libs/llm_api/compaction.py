@@ -0,0 +1,126 @@
+import os
+from typing import Callable, Dict, List, Optional
+
+from .tokens import MESSAGE_OVERHEAD, count_tokens
+
+DEFAULT_CONTEXT_TOKENS = int(os.environ.get("DEVCHAT_LLM_CONTEXT_TOKENS", "12000"))
+# model calls of one chat_tools loop, also without a ContextPolicy
+DEFAULT_MAX_ITERATIONS = int(os.environ.get("DEVCHAT_LLM_MAX_ITERATIONS", "30"))
+
+
+class ContextPolicy:
+    """
+    ContextPolicy keeps the messages of a chat_tools loop within a token budget.
+
+    Once the messages exceed max_context_tokens, older tool results are
+    shortened to max_result_tokens (or replaced by summarize(content) when
+    given), oldest first; if that is not enough they are replaced by a short
+    note and finally older turns are dropped, an assistant message together with
+    the tool results that follow it. System messages, pinned messages (the task
+    prompt) and the last keep_last messages are never touched.
+
+    max_iterations bounds the number of model calls of one loop and
+    max_total_tokens the prompt plus completion tokens it may spend.
+    """
+
+    def __init__(
+        self,
+        max_context_tokens: Optional[int] = DEFAULT_CONTEXT_TOKENS,
+        max_result_tokens: int = 500,
+        keep_last: int = 4,
+        max_iterations: Optional[int] = DEFAULT_MAX_ITERATIONS,
+        max_total_tokens: Optional[int] = None,
+        summarize: Optional[Callable[[str], str]] = None,
+    ):
+        self.max_context_tokens = max_context_tokens
+        self.max_result_tokens = max_result_tokens
+        self.keep_last = keep_last
+        self.max_iterations = max_iterations
+        self.max_total_tokens = max_total_tokens
+        self.summarize = summarize
+        # token counts by content, every message is only counted once
+        self._counts: Dict[str, int] = {}
+
+    def count(self, message: Dict, model: Optional[str] = None) -> int:
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = str(content)
+        tokens = self._counts.get(content)
+        if tokens is None:
+            tokens = count_tokens(content, model) + MESSAGE_OVERHEAD
+            if len(self._counts) > 4096:
+                self._counts.clear()
+            self._counts[content] = tokens
+        return tokens
+
+    def count_all(self, messages: List[Dict], model: Optional[str] = None) -> int:
+        return sum(self.count(message, model) for message in messages)
+
+    def _shorten(self, message: Dict, model: Optional[str]) -> Dict:
+        content = message.get("content") or ""
+        if self.summarize is not None:
+            return {**message, "content": self.summarize(content)}
+        tokens = self.count(message, model) - MESSAGE_OVERHEAD
+        keep = int(len(content) * self.max_result_tokens / max(tokens, 1))
+        omitted = tokens - self.max_result_tokens
+        return {**message, "content": f"{content[:keep]}\n... [{omitted} tokens truncated]"}
+
+    @staticmethod
+    def _note(message: Dict) -> Dict:
+        name = message.get("name") or "tool"
+        return {**message, "content": f"[result of {name} omitted to save context]"}
+
+    def compact(
+        self, messages: List[Dict], model: Optional[str] = None, pinned: List[Dict] = ()
+    ) -> List[Dict]:
+        """
+        Return messages fitted into max_context_tokens. The given messages are
+        not modified, compacted ones are replaced by new dicts.
+        """
+        if not self.max_context_tokens:
+            return messages
+        total = self.count_all(messages, model)
+        if total <= self.max_context_tokens:
+            return messages
+
+        messages = list(messages)
+        protected = set(range(max(0, len(messages) - self.keep_last), len(messages)))
+        for index, message in enumerate(messages):
+            if message.get("role") == "system" or any(message is pin for pin in pinned):
+                protected.add(index)
+        older = [i for i in range(len(messages)) if i not in protected]
+        results = [i for i in older if messages[i].get("role") in ("function", "tool")]
+
+        # first shorten the older tool results, then replace them by a note
+        for index in results:
+            if total <= self.max_context_tokens:
+                return messages
+            before = self.count(messages[index], model)
+            if before - MESSAGE_OVERHEAD > self.max_result_tokens:
+                messages[index] = self._shorten(messages[index], model)
+                total += self.count(messages[index], model) - before
+        for index in results:
+            if total <= self.max_context_tokens:
+                return messages
+            before = self.count(messages[index], model)
+            messages[index] = self._note(messages[index])
+            total += self.count(messages[index], model) - before
+
+        # a turn is a message with the tool results following it, dropped as a whole
+        # so no result is left without the call it answers
+        turns: Dict[int, List[int]] = {}
+        start = 0
+        for index, message in enumerate(messages):
+            if index == 0 or message.get("role") not in ("function", "tool"):
+                start = index
+            turns.setdefault(start, []).append(index)
+        older_set = set(older)
+        dropped = set()
+        for start, members in turns.items():
+            if total <= self.max_context_tokens:
+                break
+            if not older_set.issuperset(members):
+                continue
+            total -= sum(self.count(messages[index], model) for index in members)
+            dropped.update(members)
+        return [message for index, message in enumerate(messages) if index not in dropped]
@@ -0,0 +1,154 @@
+import os
+from typing import Dict, List, Optional, Sequence
+
+from .client import use_endpoint
+from .pipeline import RetryException, RetryPolicy, get_retry_policy, retry_policy
+
+
+class FallbackTier:
+    """
+    One tier of a fallback chain: a model (None keeps the caller's model), its
+    own request timeout and optionally another endpoint, e.g. a local server.
+    """
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        timeout: float = 60,
+        retries: int = 0,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ):
+        self.model = model
+        self.timeout = timeout
+        # retries of fallback-class errors on this tier before moving on
+        self.retries = retries
+        self.api_key = api_key
+        self.base_url = base_url
+
+
+class FallbackChain:
+    """
+    FallbackChain moves a call to the next tier when it fails with one of the
+    fallback_on error classes (see RetryPolicy.classify) instead of repeating
+    the same slow call. The last tier keeps the normal retry policy.
+    """
+
+    FALLBACK_ON = ("timeout", "connection", "rate_limit", "server", "circuit_open")
+
+    def __init__(self, tiers: Sequence[FallbackTier], fallback_on: Sequence[str] = FALLBACK_ON):
+        self.tiers: List[FallbackTier] = list(tiers)
+        self.fallback_on = tuple(fallback_on)
+
+    def tier_policy(self, tier: FallbackTier, is_last: bool) -> RetryPolicy:
+        policy = get_retry_policy()
+        if is_last:
+            return policy
+        budgets = {**policy.budgets, **{kind: tier.retries for kind in self.fallback_on}}
+        return RetryPolicy(
+            max_attempts=policy.max_attempts,
+            base_delay=policy.base_delay,
+            max_delay=policy.max_delay,
+            jitter=policy.jitter,
+            max_total_time=policy.max_total_time,
+            budgets=budgets,
+        )
+
+    @classmethod
+    def from_env(cls, value: str) -> "FallbackChain":
+        """
+        Parse "model[:timeout],..." into a chain whose first tier is the caller's model.
+        """
+        tiers = [FallbackTier(None, timeout=60)]
+        for item in value.split(","):
+            if not item.strip():
+                continue
+            model, _, timeout = item.strip().partition(":")
+            tiers.append(FallbackTier(model, timeout=float(timeout) if timeout else 60))
+        return cls(tiers)
+
+
+_fallback_chain: Optional[FallbackChain] = None
+if os.environ.get("DEVCHAT_LLM_FALLBACK_MODELS"):
+    _fallback_chain = FallbackChain.from_env(os.environ["DEVCHAT_LLM_FALLBACK_MODELS"])
+
+
+def get_fallback_chain() -> Optional[FallbackChain]:
+    return _fallback_chain
+
+
+def set_fallback_chain(chain: Optional[FallbackChain]):
+    """
+    Install (or, with None, remove) the fallback chain used by the prebuilt pipelines.
+    """
+    global _fallback_chain
+    _fallback_chain = chain
+
+
+def _tier_config(tier: FallbackTier, llm_config: Dict) -> Dict:
+    config = dict(llm_config)
+    config["model"] = tier.model or llm_config.get("model")
+    config["timeout"] = tier.timeout
+    return config
+
+
+def _should_fall_back(chain: FallbackChain, err: Exception) -> bool:
+    err = err.error if isinstance(err, RetryException) else err
+    return get_retry_policy().classify(err) in chain.fallback_on
+
+
+def _report_tier(result, index: int, config: Dict):
+    # only the content/call dicts are annotated, JSON results belong to the caller
+    if isinstance(result, dict) and "content" in result and "tool_calls" in result:
+        result["tier"] = index
+        result["model"] = config["model"]
+    return result
+
+
+def fallback(func, chain: Optional[FallbackChain] = None):
+    """
+    Run func(messages, llm_config) on each tier of the chain in turn until one
+    does not fail with a fallback-class error. Without a chain, func runs as is.
+    """
+
+    def wrapper(messages, llm_config):
+        _chain = chain or get_fallback_chain()
+        if _chain is None or not _chain.tiers:
+            return func(messages, llm_config=llm_config)
+
+        for index, tier in enumerate(_chain.tiers):
+            is_last = index + 1 == len(_chain.tiers)
+            config = _tier_config(tier, llm_config)
+            try:
+                with retry_policy(_chain.tier_policy(tier, is_last)):
+                    with use_endpoint(tier.api_key, tier.base_url):
+                        result = func(messages, llm_config=config)
+            except Exception as err:
+                if is_last or not _should_fall_back(_chain, err):
+                    raise
+                continue
+            return _report_tier(result, index, config)
+
+    return wrapper
+
+
+def afallback(func, chain: Optional[FallbackChain] = None):
+    async def wrapper(messages, llm_config):
+        _chain = chain or get_fallback_chain()
+        if _chain is None or not _chain.tiers:
+            return await func(messages, llm_config=llm_config)
+
+        for index, tier in enumerate(_chain.tiers):
+            is_last = index + 1 == len(_chain.tiers)
+            config = _tier_config(tier, llm_config)
+            try:
+                with retry_policy(_chain.tier_policy(tier, is_last)):
+                    with use_endpoint(tier.api_key, tier.base_url):
+                        result = await func(messages, llm_config=config)
+            except Exception as err:
+                if is_last or not _should_fall_back(_chain, err):
+                    raise
+                continue
+            return _report_tier(result, index, config)
+
+    return wrapper
@@ -0,0 +1,55 @@
+class FenceDetector:
+    """
+    FenceDetector watches streamed markdown and reports when the first fenced
+    code block has been closed.
+
+    A fence is a line starting with three or more backticks (or tildes); the block
+    closes at the next line made of at least as many of the same character.
+    """
+
+    def __init__(self):
+        self._line = ""
+        self._fence = None
+        self.closed = False
+
+    @staticmethod
+    def _fence_of(line: str):
+        stripped = line.strip()
+        for char in "`~":
+            count = len(stripped) - len(stripped.lstrip(char))
+            if count >= 3:
+                return char * count, stripped[count:]
+        return None, None
+
+    def _feed_line(self, line: str) -> bool:
+        fence, rest = self._fence_of(line)
+        if fence is None:
+            return False
+        if self._fence is None:
+            self._fence = fence
+            return False
+        if fence[0] == self._fence[0] and len(fence) >= len(self._fence) and not rest.strip():
+            self.closed = True
+        return self.closed
+
+    def feed(self, text: str) -> bool:
+        """
+        Feed streamed text, return True once the first code block is closed.
+        """
+        if self.closed:
+            return True
+        lines = (self._line + text).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            if self._feed_line(line):
+                return True
+        return False
+
+    def finish(self) -> bool:
+        """
+        Flush the last (unterminated) line at the end of the stream.
+        """
+        if not self.closed and self._line:
+            self._feed_line(self._line)
+            self._line = ""
+        return self.closed
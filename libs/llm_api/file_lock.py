@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+from typing import Dict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """
+    Exclusive inter-process lock on a lock file, usable as a context manager.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def __enter__(self):
+        self._file = open(self._path, "a+")
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            # LK_LOCK retries for ~10s, keep trying until the lock is acquired
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+class LockedJSONState:
+    """
+    A JSON document in a file shared by the threads and processes of all
+    workflows. Inside its with block the caller holds the lock and may read()
+    the state and write() it back; writes replace the file atomically.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file_lock = FileLock(f"{path}.lock")
+        # FileLock is per process, serialize threads of this process as well
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._file_lock.__enter__()
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._file_lock.__exit__(exc_type, exc_value, traceback)
+        finally:
+            self._thread_lock.release()
+
+    def read(self) -> Dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, state: Dict):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
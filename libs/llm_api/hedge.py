@@ -0,0 +1,185 @@
+import contextvars
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+
+class HedgePolicy:
+    """
+    HedgePolicy decides when a duplicate request is sent for a slow stream.
+
+    With a fixed delay the hedge fires after that many seconds without a first
+    token. Otherwise the threshold is learned as the given percentile of recent
+    time-to-first-token samples, clamped to [min_delay, max_delay], and
+    initial_delay is used until enough samples exist.
+    """
+
+    def __init__(
+        self,
+        delay: Optional[float] = None,
+        percentile: float = 0.95,
+        initial_delay: float = 5.0,
+        min_delay: float = 0.5,
+        max_delay: float = 30.0,
+        window: int = 50,
+        min_samples: int = 5,
+        max_hedges: int = 1,
+    ):
+        self.delay = delay
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, first_token_time: float):
+        with self._lock:
+            self._samples.append(first_token_time)
+
+    def threshold(self) -> float:
+        if self.delay is not None:
+            return self.delay
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        value = samples[min(len(samples) - 1, int(len(samples) * self.percentile))]
+        return min(self.max_delay, max(self.min_delay, value))
+
+
+def has_token(chunk) -> bool:
+    """
+    Whether chunk carries content or a tool call, unlike a role-only first chunk.
+    """
+    choices = getattr(chunk, "choices", None)
+    if not choices:
+        return False
+    delta = choices[0].delta
+    return bool(delta.content or delta.tool_calls)
+
+
+class _Attempt:
+    def __init__(self, create: Callable[[], Iterable], results: queue.Queue):
+        self.stream = None
+        self.cancelled = False
+        self._create = create
+        self._results = results
+        # run in a copy of the caller's context so instrumentation hooks still apply
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._run,), daemon=True)
+        self._started = time.monotonic()
+        self._thread.start()
+
+    def _run(self):
+        # the chunks up to the first token, chunks before it only carry the role
+        head = []
+        try:
+            self.stream = self._create()
+            iterator = iter(self.stream)
+            while not (head and has_token(head[-1])):
+                if self.cancelled:
+                    self.cancel()
+                    return
+                head.append(next(iterator))
+        except StopIteration:
+            self._results.put((self, head, iter(()), None))
+            return
+        except Exception as err:
+            self._results.put((self, head, None, err))
+            return
+        if self.cancelled:
+            self.cancel()
+            return
+        self._results.put((self, head, iterator, None))
+
+    def first_token_time(self) -> float:
+        return time.monotonic() - self._started
+
+    def cancel(self):
+        self.cancelled = True
+        close = getattr(self.stream, "close", None)
+        if close:
+            try:
+                close()
+            except Exception:
+                pass
+
+
+def hedged_stream(create: Callable[[], Iterable], policy: HedgePolicy):
+    """
+    Yield the chunks of create(), sending up to policy.max_hedges duplicate
+    requests while no attempt has produced its first token. The first attempt to
+    stream content or a tool call wins, all others are cancelled and their
+    connections closed.
+    """
+    results: queue.Queue = queue.Queue()
+    attempts = [_Attempt(create, results)]
+    errors = []
+    winner = None
+    while winner is None:
+        can_hedge = len(attempts) <= policy.max_hedges
+        try:
+            attempt, head, iterator, err = results.get(
+                timeout=policy.threshold() if can_hedge else None
+            )
+        except queue.Empty:
+            attempts.append(_Attempt(create, results))
+            continue
+        if err is not None:
+            errors.append(err)
+            if len(errors) == len(attempts):
+                # nothing left to wait for, let retry decide what to do
+                raise errors[0]
+            continue
+        winner = attempt
+
+    for attempt in attempts:
+        if attempt is not winner:
+            attempt.cancel()
+    policy.observe(winner.first_token_time())
+
+    try:
+        yield from head
+        for chunk in iterator:
+            yield chunk
+    finally:
+        winner.cancel()
+
+
+_hedge_policy: Optional[HedgePolicy] = None
+_hedge_policy_override: contextvars.ContextVar = contextvars.ContextVar(
+    "hedge_policy_override", default=None
+)
+if os.environ.get("DEVCHAT_LLM_HEDGE_DELAY"):
+    _hedge_policy = HedgePolicy(delay=float(os.environ["DEVCHAT_LLM_HEDGE_DELAY"]))
+
+
+def get_hedge_policy() -> Optional[HedgePolicy]:
+    return _hedge_policy_override.get() or _hedge_policy
+
+
+def set_hedge_policy(policy: Optional[HedgePolicy]):
+    """
+    Enable (or, with None, disable) hedging for every completion in this process.
+    """
+    global _hedge_policy
+    _hedge_policy = policy
+
+
+@contextmanager
+def hedging(policy: HedgePolicy):
+    """
+    Hedge the completions made inside the with block only.
+    """
+    token = _hedge_policy_override.set(policy)
+    try:
+        yield policy
+    finally:
+        _hedge_policy_override.reset(token)
@@ -0,0 +1,307 @@
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .hedge import has_token
+from .pricing import estimate_cost
+from .tokens import count_messages_tokens, count_tokens
+
+_sinks: List = []
+_current_record: contextvars.ContextVar = contextvars.ContextVar("llm_call_record", default=None)
+
+
+class MemorySink:
+    """
+    Keep records in memory, e.g. for tests or an in-process dashboard.
+    """
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def emit(self, record: Dict):
+        with self._lock:
+            self.records.append(record)
+
+
+class JsonlSink:
+    """
+    Append one JSON line per record to path.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def emit(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock, open(self._path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def add_sink(sink):
+    """
+    Register a sink, any object with an emit(record: dict) method.
+    """
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+if os.environ.get("DEVCHAT_LLM_METRICS"):
+    add_sink(JsonlSink(os.environ["DEVCHAT_LLM_METRICS"]))
+
+
+def current_workflow() -> str:
+    """
+    Name of the running workflow: DEVCHAT_WORKFLOW, else the directory of the
+    entry script (every workflow runs as <workflow>/main.py or similar).
+    """
+    if os.environ.get("DEVCHAT_WORKFLOW"):
+        return os.environ["DEVCHAT_WORKFLOW"]
+    script = sys.argv[0] if sys.argv and sys.argv[0] else ""
+    return os.path.basename(os.path.dirname(os.path.abspath(script))) if script else "unknown"
+
+
+class CallRecord:
+    """
+    Timings of one pipeline call, all times in seconds since the call started.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.monotonic()
+        self.model = None
+        self.connect_time = None
+        self.first_token_time = None
+        self.chunks = 0
+        self.retries: List[Dict] = []
+        self.usage = None
+        self.error = None
+        self.messages = None
+        self.contents: List[str] = []
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def final_usage(self) -> Optional[Dict]:
+        """
+        Usage reported by the provider, or counted locally when it sent none.
+        """
+        if self.usage is not None:
+            return {**self.usage, "estimated": False}
+        if self.messages is None:
+            return None
+        prompt_tokens = count_messages_tokens(self.messages, self.model)
+        completion_tokens = count_tokens("".join(self.contents), self.model)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "estimated": True,
+        }
+
+    def to_dict(self, duration: float) -> Dict:
+        streaming = duration - self.first_token_time if self.first_token_time is not None else 0
+        usage = self.final_usage()
+        cost = None
+        if usage is not None and self.model:
+            cost = estimate_cost(self.model, usage["prompt_tokens"], usage["completion_tokens"])
+        return {
+            "event": "llm_call",
+            "name": self.name,
+            "workflow": current_workflow(),
+            "model": self.model,
+            "timestamp": time.time(),
+            "connect_time": self.connect_time,
+            "time_to_first_token": self.first_token_time,
+            "duration": duration,
+            "chunks": self.chunks,
+            "chunks_per_second": self.chunks / streaming if streaming > 0 else None,
+            "retry_count": len(self.retries),
+            "retries": self.retries,
+            "usage": usage,
+            "cost": cost,
+            "error": None if self.error is None else repr(self.error),
+        }
+
+
+def current_record() -> Optional[CallRecord]:
+    return _current_record.get()
+
+
+def _start(name: str):
+    if not _sinks:
+        return None, None
+    record = CallRecord(name)
+    return record, _current_record.set(record)
+
+
+def _finish(record: CallRecord, token):
+    _current_record.reset(token)
+    _emit(record)
+
+
+def _emit(record: CallRecord):
+    data = record.to_dict(record.elapsed())
+    for sink in list(_sinks):
+        try:
+            sink.emit(data)
+        except Exception:
+            # metrics must never break the call they observe
+            pass
+
+
+def instrument(func, name: str):
+    """
+    Record a CallRecord for every call of func and emit it to the sinks.
+    Does nothing while no sink is registered.
+    """
+
+    def wrapper(*args, **kwargs):
+        record, token = _start(name)
+        if record is None:
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        except Exception as err:
+            record.error = err
+            raise
+        finally:
+            _finish(record, token)
+
+    return wrapper
+
+
+def instrument_stream(func, name: str):
+    """
+    Like instrument, for a func that returns a chunk iterator: the record stays
+    open while the caller consumes the chunks and is emitted when they end.
+    """
+
+    def wrapper(*args, **kwargs):
+        record, token = _start(name)
+        if record is None:
+            yield from func(*args, **kwargs)
+            return
+        try:
+            # the commit stage sees the record and observes the chunks into it
+            chunks = func(*args, **kwargs)
+        except Exception as err:
+            record.error = err
+            _finish(record, token)
+            raise
+        _current_record.reset(token)
+        try:
+            yield from chunks
+        except Exception as err:
+            record.error = err
+            raise
+        finally:
+            _emit(record)
+
+    return wrapper
+
+
+def ainstrument(func, name: str):
+    async def wrapper(*args, **kwargs):
+        record, token = _start(name)
+        if record is None:
+            return await func(*args, **kwargs)
+        try:
+            return await func(*args, **kwargs)
+        except Exception as err:
+            record.error = err
+            raise
+        finally:
+            _finish(record, token)
+
+    return wrapper
+
+
+def record_connect(model: Optional[str], messages: Optional[List[Dict]] = None):
+    """
+    Hook for the commit stage: the upstream request has been answered.
+    """
+    record = _current_record.get()
+    if record is not None:
+        record.model = model
+        record.messages = messages
+        record.connect_time = record.elapsed()
+
+
+def record_retry(reason: str, delay: float, err):
+    record = _current_record.get()
+    if record is not None:
+        record.retries.append(
+            {"at": record.elapsed(), "reason": reason, "delay": delay, "error": repr(err)}
+        )
+
+
+def _observe(record: CallRecord, chunk):
+    record.chunks += 1
+    if chunk.choices:
+        # the role-only first chunk arrives with the connection, not with a token
+        if record.first_token_time is None and has_token(chunk):
+            record.first_token_time = record.elapsed()
+        content = chunk.choices[0].delta.content
+        if content:
+            record.contents.append(content)
+    usage = getattr(chunk, "usage", None)
+    if usage is not None:
+        record.usage = {
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+        }
+
+
+def observe_chunks(chunks):
+    """
+    Pass chunks through, recording first token time, chunk count and usage.
+    """
+    record = _current_record.get()
+    if record is None:
+        return chunks
+    return _observe_chunks(record, chunks)
+
+
+def _observe_chunks(record, chunks):
+    try:
+        for chunk in chunks:
+            _observe(record, chunk)
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+
+def aobserve_chunks(chunks):
+    record = _current_record.get()
+    if record is None:
+        return chunks
+    return _aobserve_chunks(record, chunks)
+
+
+async def _aobserve_chunks(record, chunks):
+    if not hasattr(chunks, "__aiter__"):
+        for chunk in chunks:
+            _observe(record, chunk)
+            yield chunk
+        return
+    try:
+        async for chunk in chunks:
+            _observe(record, chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
@@ -0,0 +1,159 @@
+import json
+from typing import Callable, Optional
+
+_CLOSERS = {"}": "{", "]": "["}
+# characters that may appear outside of strings in JSON (literals and numbers included)
+_BARE_CHARS = set(" \t\r\n{}[],:0123456789-+.eEtruefalsn")
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class IncrementalJSONParser:
+    """
+    IncrementalJSONParser validates JSON text while it is being streamed.
+
+    feed() raises JSONStreamError as soon as the value can no longer become valid
+    JSON (unbalanced brackets, stray characters, ...), so a doomed generation can
+    be aborted early. Like content_to_json, a ```json fence around the value is
+    accepted and prose before the fence is skipped; everything after the value
+    is ignored, done tells when it is complete.
+
+    Elements of the top-level array, or of arrays directly under the top-level
+    object (e.g. {"test_cases": [...]}), are decoded as soon as they are complete
+    and passed to on_item(key, item), key being None for a top-level array.
+    """
+
+    def __init__(self, on_item: Optional[Callable] = None):
+        self._on_item = on_item
+        self._text = ""
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._finished = False
+        self._fence = None  # None: no fence yet, "": bare value, else the fence line seen so far
+        self._ticks = 0
+        self._prose = False
+        self._raw = []
+        self._key = None
+        self._string_start = None
+        self._last_string = None
+        self._item_start = None
+        self.items = []
+
+    def _watched(self) -> bool:
+        return self._stack == ["["] or self._stack == ["{", "["]
+
+    def _emit(self, end: int):
+        try:
+            item = json.loads(self._text[self._item_start : end])
+        except json.JSONDecodeError as err:
+            raise JSONStreamError(f"invalid array item: {err}") from err
+        self._item_start = None
+        key = self._key if self._stack[:1] == ["{"] else None
+        self.items.append((key, item))
+        if self._on_item:
+            self._on_item(key, item)
+
+    def _feed_prefix(self, char: str) -> bool:
+        """
+        Handle text before the JSON value, return True if char was consumed.
+        """
+        if self._fence is None:
+            if char == "`":
+                self._ticks += 1
+                if self._ticks == 3:
+                    self._fence = "```"
+                return True
+            self._ticks = 0
+            if char in "{[" and not self._prose:
+                self._fence = ""
+                return False
+            # prose before the fence, e.g. "Here is the result:"
+            self._prose = self._prose or not char.isspace()
+            return True
+        if self._fence and not self._fence.endswith("\n"):
+            # the language tag of the fence
+            self._fence += char
+            return True
+        return char.isspace()
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether the top-level value is complete, later text is ignored.
+        """
+        return self._finished
+
+    @property
+    def text(self) -> str:
+        """
+        All text fed so far, prose and fences included.
+        """
+        return "".join(self._raw)
+
+    def feed(self, text: str):
+        self._raw.append(text)
+        for char in text:
+            if self._finished:
+                return
+            if not self._started:
+                if self._feed_prefix(char):
+                    continue
+                if char not in "{[":
+                    raise JSONStreamError(f"unexpected {char!r} before JSON value")
+                self._started = True
+
+            index = len(self._text)
+            self._text += char
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = self._text[self._string_start : index + 1]
+                continue
+
+            if self._watched() and self._item_start is None and char not in " \t\r\n,]":
+                self._item_start = index
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = index
+            elif char in "{[":
+                self._stack.append(char)
+            elif char in "}]":
+                if not self._stack or self._stack[-1] != _CLOSERS[char]:
+                    raise JSONStreamError(f"unbalanced {char!r}")
+                if char == "]" and self._watched() and self._item_start is not None:
+                    # scalar item terminated by the end of the array
+                    self._emit(index)
+                self._stack.pop()
+                if self._watched() and self._item_start is not None:
+                    self._emit(index + 1)
+                if not self._stack:
+                    self._finished = True
+            elif char == ",":
+                if self._watched() and self._item_start is not None:
+                    self._emit(index)
+            elif char == ":":
+                if self._stack == ["{"] and self._last_string is not None:
+                    self._key = json.loads(self._last_string)
+            elif char not in _BARE_CHARS:
+                raise JSONStreamError(f"unexpected {char!r} in JSON value")
+
+    def close(self):
+        """
+        Return the decoded value, raise JSONStreamError if it is incomplete or invalid.
+        """
+        if not self._finished:
+            raise JSONStreamError("incomplete JSON value")
+        try:
+            return json.loads(self._text)
+        except json.JSONDecodeError as err:
+            raise JSONStreamError(str(err)) from err
@@ -0,0 +1,188 @@
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+
+from .instrument import add_sink
+
+DEFAULT_LEDGER_PATH = os.path.join(os.path.expanduser("~"), ".chat", "cache", "llm_usage.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    workflow TEXT,
+    name TEXT,
+    model TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    estimated INTEGER,
+    duration REAL,
+    time_to_first_token REAL,
+    retries INTEGER,
+    cost REAL,
+    error TEXT
+)
+"""
+
+GROUP_COLUMNS = ("workflow", "model", "name")
+
+
+class UsageLedger:
+    """
+    UsageLedger persists per-call token usage, latency and cost in a local
+    SQLite file, shared by all workflow processes.
+    """
+
+    def __init__(self, path: str = DEFAULT_LEDGER_PATH):
+        self._path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self._path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, record: Dict):
+        """
+        Store one instrumentation record (see instrument.CallRecord.to_dict).
+        """
+        usage = record.get("usage") or {}
+        row = (
+            record.get("timestamp", time.time()),
+            record.get("workflow"),
+            record.get("name"),
+            record.get("model"),
+            usage.get("prompt_tokens"),
+            usage.get("completion_tokens"),
+            usage.get("total_tokens"),
+            int(bool(usage.get("estimated"))),
+            record.get("duration"),
+            record.get("time_to_first_token"),
+            record.get("retry_count", 0),
+            record.get("cost"),
+            record.get("error"),
+        )
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO llm_usage (ts, workflow, name, model, prompt_tokens,"
+                " completion_tokens, total_tokens, estimated, duration, time_to_first_token,"
+                " retries, cost, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+
+    # the sink interface of instrument.add_sink
+    emit = record
+
+    def summary(
+        self, group_by: Sequence[str] = ("workflow", "model"), since: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        Aggregate calls, tokens, latency and cost per group, most expensive first.
+        """
+        columns = [c for c in group_by if c in GROUP_COLUMNS] or ["workflow"]
+        keys = ", ".join(columns)
+        sql = (
+            f"SELECT {keys}, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens),"
+            " AVG(duration), AVG(time_to_first_token), SUM(cost),"
+            " SUM(CASE WHEN error IS NULL THEN 0 ELSE 1 END)"
+            f" FROM llm_usage WHERE ts >= ? GROUP BY {keys} ORDER BY SUM(cost) DESC"
+        )
+        with self._connect() as conn:
+            rows = conn.execute(sql, (since or 0,)).fetchall()
+        names = columns + [
+            "calls",
+            "prompt_tokens",
+            "completion_tokens",
+            "avg_duration",
+            "avg_time_to_first_token",
+            "cost",
+            "errors",
+        ]
+        return [dict(zip(names, row)) for row in rows]
+
+    def recent(self, limit: int = 20) -> List[Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM llm_usage ORDER BY ts DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def enable_ledger(path: str = DEFAULT_LEDGER_PATH) -> UsageLedger:
+    """
+    Record every instrumented pipeline call into the ledger at path.
+    """
+    ledger = UsageLedger(path)
+    add_sink(ledger)
+    return ledger
+
+
+if os.environ.get("DEVCHAT_LLM_LEDGER"):
+    enable_ledger(
+        DEFAULT_LEDGER_PATH
+        if os.environ["DEVCHAT_LLM_LEDGER"] in ("1", "true")
+        else os.environ["DEVCHAT_LLM_LEDGER"]
+    )
+
+
+def _format_rows(rows: List[Dict]) -> str:
+    if not rows:
+        return "no records"
+    columns = list(rows[0].keys())
+    cells = [
+        [
+            f"{v:.4f}" if isinstance(v, float) else ("" if v is None else str(v))
+            for v in row.values()
+        ]
+        for row in rows
+    ]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(v.ljust(w) for v, w in zip(r, widths)) for r in cells]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m llm_api.ledger", description="Query the LLM usage ledger."
+    )
+    parser.add_argument(
+        "--db", default=os.environ.get("DEVCHAT_LLM_LEDGER_DB", DEFAULT_LEDGER_PATH)
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    summary_parser = commands.add_parser("summary", help="tokens and cost per group")
+    summary_parser.add_argument(
+        "--by", default="workflow,model", help=f"comma separated of {', '.join(GROUP_COLUMNS)}"
+    )
+    summary_parser.add_argument("--days", type=float, default=None, help="only the last N days")
+
+    recent_parser = commands.add_parser("recent", help="latest calls")
+    recent_parser.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args(argv)
+    ledger = UsageLedger(args.db)
+    if args.command == "summary":
+        since = time.time() - args.days * 86400 if args.days else None
+        rows = ledger.summary(args.by.split(","), since)
+    else:
+        rows = ledger.recent(args.limit)
+    print(_format_rows(rows))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -30,3 +30,15 @@ class ChatMemory:
         Return the contexts of the memory.
         """
         pass
+
+    def contains(self, content: str) -> bool:
+        """
+        Whether a message of the contexts has exactly this content.
+        """
+        return any(item["content"] == content for item in self.contexts() or [])
+
+    def snapshot(self):
+        """
+        Return the contexts as a read-only tuple.
+        """
+        return tuple(self.contexts() or [])
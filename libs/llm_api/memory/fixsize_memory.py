@@ -1,3 +1,6 @@
+import threading
+from collections import Counter, deque
+
 from .base import ChatMemory
 
 
@@ -5,47 +8,88 @@ class FixSizeChatMemory(ChatMemory):
     """
     FixSizeChatMemory is a memory class that stores up
     to a fixed number of requests and responses.
+    It is thread-safe, so concurrent chat calls may share it.
     """
 
-    def __init__(self, max_size: int = 5, messages=[], system_prompt=None):
+    def __init__(self, max_size: int = 5, messages=None, system_prompt=None):
         """
         init the memory
         """
         super().__init__()
         self._max_size = max_size
-        # store last max_size messages
-        self._messages = messages[-max_size * 2 :]
+        # store last max_size messages, the deque drops the oldest one in O(1);
+        # max_size <= 0 keeps every message, as slicing with [-0:] used to
+        self._messages = deque(maxlen=max_size * 2 if max_size > 0 else None)
+        # occurrences of every message content, for contains()
+        self._contents = Counter()
         self._system_prompt = system_prompt
+        self._snapshot = None
+        self._lock = threading.Lock()
+        for message in messages or ():
+            self._push(message)
+
+    def _push(self, message):
+        if len(self._messages) == self._messages.maxlen:
+            self._forget(self._messages[0])
+        self._messages.append(message)
+        content = message.get("content")
+        if isinstance(content, str):
+            self._contents[content] += 1
+        self._snapshot = None
+
+    def _forget(self, message):
+        content = message.get("content")
+        if isinstance(content, str):
+            self._contents[content] -= 1
+            if not self._contents[content]:
+                del self._contents[content]
 
     def append(self, request, response):
         """
         Append a request and response to the memory.
         """
-        self._messages.append(request)
-        self._messages.append(response)
-        if len(self._messages) > self._max_size * 2:
-            self._messages = self._messages[-self._max_size * 2 :]
+        with self._lock:
+            self._push(request)
+            self._push(response)
 
     def append_request(self, request):
         """
         Append a request to the memory.
         """
-        self._messages.append(request)
+        with self._lock:
+            self._push(request)
 
     def append_response(self, response):
         """
         Append a response to the memory.
         """
-        self._messages.append(response)
-        if len(self._messages) > self._max_size * 2:
-            self._messages = self._messages[-self._max_size * 2 :]
+        with self._lock:
+            self._push(response)
+
+    def contains(self, content: str) -> bool:
+        """
+        Whether a message of the contexts has exactly this content.
+        """
+        if self._system_prompt and content == self._system_prompt:
+            return True
+        with self._lock:
+            return content in self._contents
+
+    def snapshot(self):
+        """
+        Return the contexts as a tuple, shared by all readers until the next append.
+        """
+        with self._lock:
+            if self._snapshot is None:
+                messages = tuple(self._messages)
+                # insert system prompt at the beginning
+                if self._system_prompt:
+                    messages = ({"role": "system", "content": self._system_prompt},) + messages
+                self._snapshot = messages
+            return self._snapshot
 
     def contexts(self):
         """
         Return the contexts of the memory.
         """
-        messages = self._messages.copy()
-        # insert system prompt at the beginning
-        if self._system_prompt:
-            messages = [{"role": "system", "content": self._system_prompt}] + messages
-        return messages
+        return list(self.snapshot())
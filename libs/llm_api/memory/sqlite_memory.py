@@ -0,0 +1,198 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Optional
+
+from ..instrument import current_workflow
+from .fixsize_memory import FixSizeChatMemory
+
+DEFAULT_MEMORY_PATH = os.path.join(os.path.expanduser("~"), ".chat", "cache", "llm_memory.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_memory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    workflow TEXT NOT NULL,
+    session TEXT NOT NULL,
+    ts REAL NOT NULL,
+    message TEXT NOT NULL
+)
+"""
+
+_INDEX = "CREATE INDEX IF NOT EXISTS chat_memory_session ON chat_memory (workflow, session, id)"
+
+
+@contextmanager
+def _connect(path: str):
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+class _SessionWriter:
+    """
+    The rows of one session waiting to be written. It is separate from the
+    memory so the finalizer flushing it holds no reference to the memory.
+    """
+
+    def __init__(self, path: str, workflow: str, session: str, keep: int):
+        self.path = path
+        self.workflow = workflow
+        self.session = session
+        self.keep = keep
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            rows, self.pending = self.pending, []
+            with _connect(self.path) as conn:
+                conn.executemany(
+                    "INSERT INTO chat_memory (workflow, session, ts, message) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                conn.execute(
+                    "DELETE FROM chat_memory WHERE workflow = ? AND session = ? AND id NOT IN"
+                    " (SELECT id FROM chat_memory WHERE workflow = ? AND session = ?"
+                    " ORDER BY id DESC LIMIT ?)",
+                    (self.workflow, self.session, self.workflow, self.session, self.keep),
+                )
+
+
+class SQLiteChatMemory(FixSizeChatMemory):
+    """
+    SQLiteChatMemory is a FixSizeChatMemory persisted in a local SQLite file,
+    so a later invocation of the same workflow and session continues the
+    conversation.
+
+    Only the last max_size requests and responses are loaded, on first use.
+    By default every append is written at once. With batch_size > 1 messages
+    are written in one transaction per batch_size messages, when the memory is
+    collected, at interpreter exit or on flush(); until then they are lost if
+    the process is killed. The database runs in WAL mode, rows are only ever
+    inserted and pruned to the last max_size turns, so several processes may
+    share a session.
+    """
+
+    def __init__(
+        self,
+        session: str = "default",
+        workflow: Optional[str] = None,
+        max_size: int = 5,
+        system_prompt=None,
+        path: str = DEFAULT_MEMORY_PATH,
+        batch_size: int = 1,
+    ):
+        """
+        init the memory, workflow defaults to the running workflow
+        """
+        super().__init__(max_size=max_size, system_prompt=system_prompt)
+        self._batch_size = batch_size
+        self._loaded = False
+        # a negative LIMIT is no limit, for a memory without max_size
+        keep = self._messages.maxlen or -1
+        self._writer = _SessionWriter(path, workflow or current_workflow(), session, keep)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with _connect(path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            conn.execute(_INDEX)
+        # also runs at interpreter exit, without keeping the memory alive
+        weakref.finalize(self, self._writer.flush)
+
+    def _load(self):
+        writer = self._writer
+        with writer.lock:
+            if self._loaded:
+                return
+            with _connect(writer.path) as conn:
+                rows = conn.execute(
+                    "SELECT message FROM chat_memory WHERE workflow = ? AND session = ?"
+                    " ORDER BY id DESC LIMIT ?",
+                    (writer.workflow, writer.session, writer.keep),
+                ).fetchall()
+            with self._lock:
+                for (message,) in reversed(rows):
+                    self._push(json.loads(message))
+            self._loaded = True
+
+    def _store(self, *messages):
+        writer = self._writer
+        now = time.time()
+        with writer.lock:
+            writer.pending.extend(
+                (writer.workflow, writer.session, now, json.dumps(message, ensure_ascii=False))
+                for message in messages
+            )
+            if len(writer.pending) < self._batch_size:
+                return
+        writer.flush()
+
+    def flush(self):
+        """
+        Write the pending messages and prune the session to its last max_size turns.
+        """
+        self._writer.flush()
+
+    def clear(self):
+        """
+        Forget the session, in memory and on disk.
+        """
+        writer = self._writer
+        with writer.lock:
+            writer.pending = []
+            with _connect(writer.path) as conn:
+                conn.execute(
+                    "DELETE FROM chat_memory WHERE workflow = ? AND session = ?",
+                    (writer.workflow, writer.session),
+                )
+            with self._lock:
+                self._messages.clear()
+                self._contents.clear()
+                self._snapshot = None
+            self._loaded = True
+
+    def append(self, request, response):
+        """
+        Append a request and response to the memory.
+        """
+        if not self._loaded:
+            self._load()
+        super().append(request, response)
+        self._store(request, response)
+
+    def append_request(self, request):
+        """
+        Append a request to the memory.
+        """
+        if not self._loaded:
+            self._load()
+        super().append_request(request)
+        self._store(request)
+
+    def append_response(self, response):
+        """
+        Append a response to the memory.
+        """
+        if not self._loaded:
+            self._load()
+        super().append_response(response)
+        self._store(response)
+
+    def contains(self, content: str) -> bool:
+        if not self._loaded:
+            self._load()
+        return super().contains(content)
+
+    def snapshot(self):
+        if not self._loaded:
+            self._load()
+        return super().snapshot()
@@ -0,0 +1,109 @@
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from ..tokens import count_message_tokens
+from .base import ChatMemory
+
+
+class TokenBudgetChatMemory(ChatMemory):
+    """
+    TokenBudgetChatMemory keeps the latest turns that fit into max_tokens.
+
+    Each message is counted once, when it is appended, and the oldest turns
+    (a request and its responses) are evicted until the budget fits again.
+    The system prompt and the pinned messages, e.g. few-shot examples, count
+    against the budget but are never evicted. The latest turn is always kept,
+    even if it alone exceeds the budget.
+    It is thread-safe, so concurrent chat calls may share it.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 4000,
+        pinned: List[Dict] = (),
+        messages: List[Dict] = (),
+        system_prompt: Optional[str] = None,
+        model: Optional[str] = None,
+    ):
+        """
+        init the memory, messages is earlier history and may be evicted
+        """
+        super().__init__()
+        self._max_tokens = max_tokens
+        self._model = model
+        self._prefix = list(pinned)
+        if system_prompt:
+            self._prefix.insert(0, {"role": "system", "content": system_prompt})
+        self._prefix_tokens = sum(count_message_tokens(m, model) for m in self._prefix)
+        # turns as [messages, tokens], oldest first
+        self._turns = deque()
+        self._tokens = 0
+        self._lock = threading.Lock()
+        for message in messages:
+            if message.get("role") == "user" or not self._turns:
+                self._start_turn(message)
+            else:
+                self._extend_turn(message)
+        self._evict()
+
+    @property
+    def tokens(self) -> int:
+        """
+        Tokens of the current contexts, pinned messages included.
+        """
+        with self._lock:
+            return self._prefix_tokens + self._tokens
+
+    def _start_turn(self, message: Dict):
+        tokens = count_message_tokens(message, self._model)
+        self._turns.append([[message], tokens])
+        self._tokens += tokens
+
+    def _extend_turn(self, message: Dict):
+        tokens = count_message_tokens(message, self._model)
+        turn = self._turns[-1]
+        turn[0].append(message)
+        turn[1] += tokens
+        self._tokens += tokens
+
+    def _evict(self):
+        while len(self._turns) > 1 and self._prefix_tokens + self._tokens > self._max_tokens:
+            _, tokens = self._turns.popleft()
+            self._tokens -= tokens
+
+    def append(self, request, response):
+        """
+        Append a request and response to the memory.
+        """
+        with self._lock:
+            self._start_turn(request)
+            self._extend_turn(response)
+            self._evict()
+
+    def append_request(self, request):
+        """
+        Append a request to the memory.
+        """
+        with self._lock:
+            self._start_turn(request)
+            self._evict()
+
+    def append_response(self, response):
+        """
+        Append a response to the memory.
+        """
+        with self._lock:
+            if self._turns:
+                self._extend_turn(response)
+            else:
+                self._start_turn(response)
+            self._evict()
+
+    def contexts(self):
+        """
+        Return the contexts of the memory.
+        """
+        with self._lock:
+            messages = [message for turn, _ in self._turns for message in turn]
+        return self._prefix + messages
@@ -0,0 +1,315 @@
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class MockConfig:
+    """
+    Behaviour of the mock /chat/completions endpoint, changeable while it runs.
+
+    content is streamed in pieces of chunk_size characters with delay seconds
+    between chunks, followed by tool_calls whose arguments are streamed the same
+    way. The first fail_times requests answer with error_status (and an
+    optional retry-after), and stall holds every request that long before the
+    response headers are sent, to trigger client timeouts. With echo the answer
+    is the last user message, so concurrent callers can check they got theirs.
+    """
+
+    def __init__(
+        self,
+        content: str = "Hello from the mock server.",
+        tool_calls: Optional[List[Dict]] = None,
+        chunk_size: int = 4,
+        delay: float = 0.0,
+        fail_times: int = 0,
+        error_status: int = 500,
+        retry_after: Optional[float] = None,
+        stall: float = 0.0,
+        model: str = "mock-model",
+        echo: bool = False,
+    ):
+        self.content = content
+        # [{"name": ..., "arguments": "{...}"}]
+        self.tool_calls = tool_calls or []
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.fail_times = fail_times
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.stall = stall
+        self.model = model
+        # answer with the last user message instead of content
+        self.echo = echo
+
+
+class MockLLMServer:
+    """
+    MockLLMServer is a local OpenAI compatible server for offline tests and
+    benchmarks. Point OPENAI_API_BASE (or use_endpoint) at base_url.
+
+        with MockLLMServer(MockConfig(chunk_size=8)) as server:
+            with use_endpoint("sk-mock", server.base_url):
+                chat_completion_stream(messages, {"model": "mock-model"})
+    """
+
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or MockConfig()
+        self.requests: List[Dict] = []
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def request_count(self) -> int:
+        with self._lock:
+            return len(self.requests)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _register(self, body: Dict) -> int:
+        with self._lock:
+            self.requests.append(body)
+            return len(self.requests)
+
+
+def _pieces(text: str, size: int) -> List[str]:
+    size = max(1, size)
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+def _chunk(completion_id: str, model: str, delta: Dict, finish_reason=None) -> Dict:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def _answer(config: MockConfig, body: Dict) -> str:
+    if config.echo:
+        users = [m for m in body.get("messages", []) if m.get("role") == "user"]
+        return str(users[-1].get("content") or "") if users else ""
+    return config.content
+
+
+def _usage(config: MockConfig, body: Dict) -> Dict:
+    prompt = sum(len(str(m.get("content") or "")) for m in body.get("messages", [])) // 4
+    completion = (
+        len(_answer(config, body)) + sum(len(c.get("arguments", "")) for c in config.tool_calls)
+    ) // 4
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+    }
+
+
+def stream_chunks(config: MockConfig, body: Dict) -> List[Dict]:
+    """
+    The chat.completion.chunk payloads of one streamed response.
+    """
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    model = body.get("model") or config.model
+    chunks = [_chunk(completion_id, model, {"role": "assistant", "content": ""})]
+    for piece in _pieces(_answer(config, body), config.chunk_size):
+        chunks.append(_chunk(completion_id, model, {"content": piece}))
+    for index, call in enumerate(config.tool_calls):
+        head = {
+            "index": index,
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": call["name"], "arguments": ""},
+        }
+        chunks.append(_chunk(completion_id, model, {"tool_calls": [head]}))
+        for piece in _pieces(call.get("arguments", ""), config.chunk_size):
+            delta = {"tool_calls": [{"index": index, "function": {"arguments": piece}}]}
+            chunks.append(_chunk(completion_id, model, delta))
+    finish_reason = "tool_calls" if config.tool_calls else "stop"
+    chunks.append(_chunk(completion_id, model, {}, finish_reason))
+    if (body.get("stream_options") or {}).get("include_usage"):
+        usage_chunk = _chunk(completion_id, model, {})
+        usage_chunk["choices"] = []
+        usage_chunk["usage"] = _usage(config, body)
+        chunks.append(usage_chunk)
+    return chunks
+
+
+def completion(config: MockConfig, body: Dict) -> Dict:
+    """
+    The chat.completion payload of one non-streamed response.
+    """
+    message = {"role": "assistant", "content": _answer(config, body) or None}
+    if config.tool_calls:
+        message["tool_calls"] = [
+            {
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": call.get("arguments", "")},
+            }
+            for call in config.tool_calls
+        ]
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model") or config.model,
+        "choices": [
+            {
+                "index": 0,
+                "message": message,
+                "finish_reason": "tool_calls" if config.tool_calls else "stop",
+            }
+        ],
+        "usage": _usage(config, body),
+    }
+
+
+def _make_handler(server: MockLLMServer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle(self):
+            try:
+                super().handle()
+            except (BrokenPipeError, ConnectionResetError):
+                # the client went away between requests or mid-response, e.g. a
+                # cancelled hedge or stop_after_code_block, nothing to report
+                self.close_connection = True
+
+        def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                return
+
+            config = server.config
+            number = server._register(body)
+            if config.stall:
+                time.sleep(config.stall)
+            if number <= config.fail_times:
+                headers = {}
+                if config.retry_after is not None:
+                    headers["retry-after-ms"] = str(int(config.retry_after * 1000))
+                error = {"message": "injected failure", "type": "server_error", "code": None}
+                self._send_json(config.error_status, {"error": error}, headers)
+                return
+
+            if not body.get("stream"):
+                self._send_json(200, completion(config, body))
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for chunk in stream_chunks(config, body):
+                    if config.delay:
+                        time.sleep(config.delay)
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                # the client closed the stream early
+                self.close_connection = True
+
+    return Handler
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m llm_api.mock_server",
+        description="Serve a mock OpenAI compatible /chat/completions endpoint.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--content", default=MockConfig().content)
+    parser.add_argument(
+        "--tool-call",
+        action="append",
+        default=[],
+        metavar="NAME=JSON",
+        help='stream a tool call, e.g. get_weather=\'{"city": "Paris"}\'',
+    )
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds between chunks")
+    parser.add_argument("--fail-times", type=int, default=0, help="fail the first N requests")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--retry-after", type=float, default=None, help="seconds")
+    parser.add_argument("--stall", type=float, default=0.0, help="seconds before responding")
+    args = parser.parse_args(argv)
+
+    tool_calls = []
+    for item in args.tool_call:
+        name, _, arguments = item.partition("=")
+        tool_calls.append({"name": name, "arguments": arguments or "{}"})
+    config = MockConfig(
+        content=args.content,
+        tool_calls=tool_calls,
+        chunk_size=args.chunk_size,
+        delay=args.delay,
+        fail_times=args.fail_times,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        stall=args.stall,
+    )
+    server = MockLLMServer(config, args.host, args.port)
+    print(f"OPENAI_API_BASE={server.base_url}", flush=True)
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,52 @@ import json
 import os
 import re
 import sys
-from functools import wraps
+from functools import partial, wraps
 from typing import Dict, List, Optional
 
 import openai
 
+from .async_pipeline import (
+    aiterate,
+    async_exception_handle,
+    async_pipeline,
+    async_retry,
+)
+from .cache import (
+    arecord_chunks,
+    discard_current_response,
+    get_response_cache,
+    lookup_response,
+    record_chunks,
+    replay_chunks,
+    request_key,
+)
+from .circuit import aguard_chunks, circuit_scope, get_circuit_breaker, guard_chunks
+from .client import current_endpoint, get_async_client, get_client
+from .fallback import afallback, fallback
+from .fence import FenceDetector
+from .hedge import get_hedge_policy, hedged_stream
+from .instrument import (
+    ainstrument,
+    aobserve_chunks,
+    current_record,
+    instrument,
+    observe_chunks,
+    record_connect,
+)
+from .jsonstream import IncrementalJSONParser, JSONStreamError
 from .pipeline import (
     RetryException,
     exception_err,
     exception_handle,
     exception_output_handle,
+    get_retry_policy,
     parallel,
     pipeline,
     retry,
 )
+from .ratelimit import estimate_tokens, get_rate_limiter, rate_limit_scope
+from .singleflight import get_single_flight
 
 
 def _try_remove_markdown_block_flag(content):
@@ -39,46 +71,222 @@ def _try_remove_markdown_block_flag(content):
         return content
 
 
+def stream_usage_supported() -> bool:
+    """
+    Whether the endpoint accepts stream_options.include_usage. Only the official
+    API is assumed to, other endpoints opt in with DEVCHAT_LLM_STREAM_USAGE=1.
+    """
+    if os.environ.get("DEVCHAT_LLM_STREAM_USAGE", "") in ("0", "1"):
+        return os.environ["DEVCHAT_LLM_STREAM_USAGE"] == "1"
+    _, base_url = current_endpoint()
+    return not base_url or "api.openai.com" in base_url
+
+
+def _create_stream(messages: List[Dict], llm_config: Dict):
+    # retries are owned by pipeline.retry, so the SDK must not retry on its own
+    client = get_client(max_retries=0)
+
+    cache = get_response_cache()
+    if cache is not None:
+        key, cached_chunks = lookup_response(messages, llm_config)
+        if cached_chunks is not None:
+            record_connect(llm_config.get("model"), messages)
+            return replay_chunks(cached_chunks)
+
+    # an open circuit fails before the call waits for rate limit tokens
+    breaker = get_circuit_breaker()
+    scope = circuit_scope(llm_config.get("model"))
+    if breaker is not None:
+        breaker.before_call(scope)
+
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        limiter.acquire(rate_limit_scope(), estimate_tokens(messages, llm_config))
+
+    if current_record() is not None and stream_usage_supported():
+        llm_config = {**llm_config, "stream_options": {"include_usage": True}}
+    try:
+        stream = client.chat.completions.create(messages=messages, **llm_config)
+    except Exception as err:
+        if breaker is not None:
+            breaker.record_failure(scope, get_retry_policy().classify(err))
+        raise
+    record_connect(llm_config.get("model"), messages)
+    if breaker is not None:
+        breaker.record_success(scope)
+        stream = guard_chunks(stream, breaker, scope, get_retry_policy().classify)
+    return stream if cache is None else record_chunks(stream, cache, key)
+
+
 def chat_completion_stream_commit(
     messages: List[Dict],  # [{"role": "user", "content": "hello"}]
     llm_config: Dict,  # {"model": "...", ...}
 ):
-    client = openai.OpenAI(
-        api_key=os.environ.get("OPENAI_API_KEY", None),
-        base_url=os.environ.get("OPENAI_API_BASE", None),
-    )
+    # the upstream call may start lazily, so freeze the request it is made for,
+    # this also leaves the caller's llm_config untouched
+    messages, config = list(messages), {"timeout": 60, **llm_config, "stream": True}
+
+    def create():
+        return _create_stream(messages, config)
+
+    hedge_policy = get_hedge_policy()
+    if hedge_policy is not None:
+        create = partial(hedged_stream, create, hedge_policy)
 
-    llm_config["stream"] = True
-    llm_config["timeout"] = 60
-    return client.chat.completions.create(messages=messages, **llm_config)
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return observe_chunks(create())
+    return observe_chunks(single_flight.do(request_key(messages, config), create))
 
 
 def chat_completion_stream_raw(**kwargs):
-    client = openai.OpenAI(
-        api_key=os.environ.get("OPENAI_API_KEY", None),
-        base_url=os.environ.get("OPENAI_API_BASE", None),
-    )
+    client = get_client(max_retries=0)
 
     kwargs["stream"] = True
     kwargs["timeout"] = 60
+    # raw streams share the token bucket of the pipelines
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        limiter.acquire(rate_limit_scope(), estimate_tokens(kwargs.get("messages", []), kwargs))
     return client.chat.completions.create(**kwargs)
 
 
+async def achat_completion_stream_commit(
+    messages: List[Dict],  # [{"role": "user", "content": "hello"}]
+    llm_config: Dict,  # {"model": "...", ...}
+):
+    client = get_async_client(max_retries=0)
+
+    llm_config = {"timeout": 60, **llm_config, "stream": True}
+
+    cache = get_response_cache()
+    if cache is not None:
+        key, cached_chunks = lookup_response(messages, llm_config)
+        if cached_chunks is not None:
+            record_connect(llm_config.get("model"), messages)
+            return aobserve_chunks(replay_chunks(cached_chunks))
+
+    breaker = get_circuit_breaker()
+    scope = circuit_scope(llm_config.get("model"))
+    if breaker is not None:
+        breaker.before_call(scope)
+
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        await limiter.aacquire(rate_limit_scope(), estimate_tokens(messages, llm_config))
+
+    if current_record() is not None and stream_usage_supported():
+        llm_config = {**llm_config, "stream_options": {"include_usage": True}}
+    try:
+        stream = await client.chat.completions.create(messages=messages, **llm_config)
+    except Exception as err:
+        if breaker is not None:
+            breaker.record_failure(scope, get_retry_policy().classify(err))
+        raise
+    record_connect(llm_config.get("model"), messages)
+    if breaker is not None:
+        breaker.record_success(scope)
+        stream = aguard_chunks(stream, breaker, scope, get_retry_policy().classify)
+    return aobserve_chunks(stream if cache is None else arecord_chunks(stream, cache, key))
+
+
+def chunk_delta(chunk):
+    """
+    Decode a streamed chunk once into (content, tool_calls).
+
+    tool_calls is the raw list of tool call deltas (or None). Chunks without
+    choices, such as the trailing usage chunk, decode to (None, None).
+    """
+    if not chunk.choices:
+        return None, None
+    delta = chunk.choices[0].delta
+    return delta.content, delta.tool_calls
+
+
+def merge_tool_calls(tool_calls, call_deltas):
+    """
+    Merge streamed tool call deltas into tool_calls ([{"name", "arguments"}]).
+    """
+    for call in call_deltas:
+        if call.index is not None:
+            while call.index >= len(tool_calls):
+                tool_calls.append({"name": None, "arguments": ""})
+            target = tool_calls[call.index]
+        else:
+            if not tool_calls:
+                tool_calls.append({"name": None, "arguments": ""})
+            target = tool_calls[-1]
+        function = call.function
+        if function is None:
+            continue
+        if function.name:
+            target["name"] = function.name
+        if function.arguments:
+            target["arguments"] += function.arguments
+    return tool_calls
+
+
 def stream_out_chunk(chunks):
     for chunk in chunks:
-        chunk_dict = chunk.dict()
-        delta = chunk_dict["choices"][0]["delta"]
-        if delta.get("content", None):
-            print(delta["content"], end="", flush=True)
+        content, _ = chunk_delta(chunk)
+        if content:
+            print(content, end="", flush=True)
         yield chunk
 
 
+def close_chunks(chunks):
+    """
+    Stop an upstream stream early, closing its HTTP response.
+    """
+    close = getattr(chunks, "close", None)
+    if close:
+        close()
+
+
 def retry_timeout(chunks):
     try:
         for chunk in chunks:
             yield chunk
     except (openai.APIConnectionError, openai.APITimeoutError) as err:
         raise RetryException(err) from err
+    finally:
+        # reached on normal exhaustion too, where closing is a no-op
+        close_chunks(chunks)
+
+
+def stop_after_code_block(chunks):
+    """
+    Pass chunks through until the first fenced code block of the content closes,
+    then close the upstream stream instead of waiting for the rest.
+    """
+    detector = FenceDetector()
+    for chunk in chunks:
+        content, _ = chunk_delta(chunk)
+        yield chunk
+        if content and detector.feed(content):
+            close_chunks(chunks)
+            return
+
+
+def _prepend(first, chunks):
+    try:
+        yield first
+        yield from chunks
+    finally:
+        close_chunks(chunks)
+
+
+def prefetch_first_chunk(chunks):
+    """
+    Read the first chunk before returning the stream, so that a retry around the
+    pipeline also covers failures that only surface on the first read.
+    """
+    iterator = iter(chunks)
+    try:
+        first = next(iterator)
+    except StopIteration:
+        return iter(())
+    return _prepend(first, iterator)
 
 
 def chunk_list(chunks):
@@ -86,36 +294,150 @@ def chunk_list(chunks):
 
 
 def chunks_content(chunks):
-    content = None
+    contents = []
     for chunk in chunks:
-        chunk_dict = chunk.dict()
-        delta = chunk_dict["choices"][0]["delta"]
-        if delta.get("content", None):
-            if content is None:
-                content = ""
-            content += delta["content"]
-    return content
+        content, _ = chunk_delta(chunk)
+        if content:
+            contents.append(content)
+    return "".join(contents) if contents else None
 
 
 def chunks_call(chunks):
     tool_calls = []
+    for chunk in chunks:
+        _, call_deltas = chunk_delta(chunk)
+        if call_deltas:
+            merge_tool_calls(tool_calls, call_deltas)
+    return tool_calls
+
+
+def tool_arguments_complete(arguments: str) -> bool:
+    """
+    Whether the streamed JSON arguments of a tool call are complete.
+    """
+    if not arguments.rstrip().endswith("}"):
+        return False
+    try:
+        json.loads(arguments)
+    except ValueError:
+        return False
+    return True
+
+
+def _dispatch_calls(tool_calls, dispatched: int, on_call, final: bool = False) -> int:
+    # calls stream one after another: a call is complete once the next one
+    # begins or its arguments parse, and every call is complete at the end
+    while dispatched < len(tool_calls):
+        call = tool_calls[dispatched]
+        is_last = dispatched + 1 == len(tool_calls)
+        if is_last and not final and not tool_arguments_complete(call["arguments"]):
+            break
+        on_call(dispatched, {"function_name": call["name"], "parameters": call["arguments"]})
+        dispatched += 1
+    return dispatched
+
+
+def chunks_content_and_call(chunks, stream_out: bool = False, on_call=None):
+    """
+    Single pass over the stream that accumulates content and tool calls together
+    (and optionally echoes content), so chunks are neither stored nor decoded twice.
+
+    With on_call, each tool call is passed to on_call(index, call) as soon as its
+    arguments are complete, while the rest of the response is still streaming.
 
+    The result is a parallel value that unpacks into to_dict_content_and_call.
+    """
+    contents = []
+    tool_calls = []
+    dispatched = 0
     for chunk in chunks:
-        chunk = chunk.dict()
-        delta = chunk["choices"][0]["delta"]
-        if "tool_calls" in delta and delta["tool_calls"]:
-            tool_call = delta["tool_calls"][0]["function"]
-            if delta["tool_calls"][0].get("index", None) is not None:
-                index = delta["tool_calls"][0]["index"]
-                if index >= len(tool_calls):
-                    tool_calls.append({"name": None, "arguments": ""})
-            if tool_call.get("name", None):
-                tool_calls[-1]["name"] = tool_call["name"]
-            if tool_call.get("arguments", None):
-                tool_calls[-1]["arguments"] += tool_call["arguments"]
+        content, call_deltas = chunk_delta(chunk)
+        if content:
+            contents.append(content)
+            if stream_out:
+                print(content, end="", flush=True)
+        if call_deltas:
+            merge_tool_calls(tool_calls, call_deltas)
+            if on_call is not None:
+                dispatched = _dispatch_calls(tool_calls, dispatched, on_call)
+    if on_call is not None:
+        _dispatch_calls(tool_calls, dispatched, on_call, final=True)
+    return {
+        "__type__": "parallel",
+        "value": ["".join(contents) if contents else None, tool_calls],
+    }
+
+
+async def astream_out_chunk(chunks):
+    async for chunk in aiterate(chunks):
+        content, _ = chunk_delta(chunk)
+        if content:
+            print(content, end="", flush=True)
+        yield chunk
+
+
+async def aretry_timeout(chunks):
+    try:
+        async for chunk in aiterate(chunks):
+            yield chunk
+    except (openai.APIConnectionError, openai.APITimeoutError) as err:
+        raise RetryException(err) from err
+    finally:
+        # like retry_timeout, so closing the stage closes the upstream stream
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+
+
+async def astop_after_code_block(chunks):
+    detector = FenceDetector()
+    async for chunk in aiterate(chunks):
+        content, _ = chunk_delta(chunk)
+        yield chunk
+        if content and detector.feed(content):
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            return
+
+
+async def achunk_list(chunks):
+    return [chunk async for chunk in aiterate(chunks)]
+
+
+async def achunks_content(chunks):
+    contents = []
+    async for chunk in aiterate(chunks):
+        content, _ = chunk_delta(chunk)
+        if content:
+            contents.append(content)
+    return "".join(contents) if contents else None
+
+
+async def achunks_call(chunks):
+    tool_calls = []
+    async for chunk in aiterate(chunks):
+        _, call_deltas = chunk_delta(chunk)
+        if call_deltas:
+            merge_tool_calls(tool_calls, call_deltas)
     return tool_calls
 
 
+async def achunks_content_and_call(chunks, stream_out: bool = False):
+    contents = []
+    tool_calls = []
+    async for chunk in aiterate(chunks):
+        content, call_deltas = chunk_delta(chunk)
+        if content:
+            contents.append(content)
+            if stream_out:
+                print(content, end="", flush=True)
+        if call_deltas:
+            merge_tool_calls(tool_calls, call_deltas)
+    return {
+        "__type__": "parallel",
+        "value": ["".join(contents) if contents else None, tool_calls],
+    }
+
+
 def content_to_json(content):
     try:
         # json will format as ```json ... ``` in 1106 model
@@ -123,75 +445,270 @@ def content_to_json(content):
         response_obj = json.loads(response_content)
         return response_obj
     except json.JSONDecodeError as err:
+        discard_current_response()
         raise RetryException(err) from err
     except Exception as err:
         raise err
 
 
+def chunks_json(chunks, on_item=None):
+    """
+    Parse the streamed content as JSON while it arrives.
+
+    The stream is aborted (and the request retried) as soon as the content can no
+    longer be valid JSON, and closed once the value is complete (unless a response
+    cache has to store the whole stream); completed array
+    items are passed to on_item(key, item) before the whole response has arrived.
+    Content the parser does not accept as a whole is retried with content_to_json.
+    """
+    parser = IncrementalJSONParser(on_item)
+    try:
+        for chunk in chunks:
+            content, _ = chunk_delta(chunk)
+            if content:
+                parser.feed(content)
+                # a response is only cached once its stream is exhausted, so
+                # keep reading (and ignoring) the rest while a cache is active
+                if parser.done and get_response_cache() is None:
+                    break
+    except JSONStreamError as err:
+        discard_current_response()
+        raise RetryException(err) from err
+    finally:
+        close_chunks(chunks)
+    try:
+        return parser.close()
+    except JSONStreamError:
+        return content_to_json(parser.text)
+
+
+async def achunks_json(chunks, on_item=None):
+    parser = IncrementalJSONParser(on_item)
+    try:
+        async for chunk in aiterate(chunks):
+            content, _ = chunk_delta(chunk)
+            if content:
+                parser.feed(content)
+                if parser.done and get_response_cache() is None:
+                    break
+    except JSONStreamError as err:
+        discard_current_response()
+        raise RetryException(err) from err
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()
+    try:
+        return parser.close()
+    except JSONStreamError:
+        return content_to_json(parser.text)
+
+
+def error_reason(err):
+    """
+    What a failed call reports as its error: the API error type, else the exception.
+    """
+    return err.type if isinstance(err, openai.APIError) else err
+
+
+def error_result(err) -> Dict:
+    """
+    The content dict a pipeline returns instead of raising err.
+    """
+    return {"content": None, "function_name": None, "parameters": "", "error": error_reason(err)}
+
+
+def call_error_result(err) -> Dict:
+    """
+    Like error_result, for the pipelines that also return tool_calls.
+    """
+    return {**error_result(err), "tool_calls": []}
+
+
 def to_dict_content_and_call(content, tool_calls=[]):
     return {
         "content": content,
         "function_name": tool_calls[0]["name"] if tool_calls else None,
         "parameters": tool_calls[0]["arguments"] if tool_calls else "",
         "tool_calls": tool_calls,
+        "all_calls": [
+            {"function_name": call["name"], "parameters": call["arguments"]} for call in tool_calls
+        ],
     }
 
 
-chat_completion_content = retry(
-    pipeline(chat_completion_stream_commit, retry_timeout, chunks_content), times=3
+chat_completion_content = fallback(
+    instrument(
+        retry(pipeline(chat_completion_stream_commit, retry_timeout, chunks_content), times=3),
+        "chat_completion_content",
+    )
 )
 
-chat_completion_stream_content = retry(
-    pipeline(chat_completion_stream_commit, retry_timeout, stream_out_chunk, chunks_content),
-    times=3,
+chat_completion_stream_content = fallback(
+    instrument(
+        retry(
+            pipeline(
+                chat_completion_stream_commit, retry_timeout, stream_out_chunk, chunks_content
+            ),
+            times=3,
+        ),
+        "chat_completion_stream_content",
+    )
 )
 
-chat_completion_call = retry(
-    pipeline(chat_completion_stream_commit, retry_timeout, chunks_call), times=3
+chat_completion_call = fallback(
+    instrument(
+        retry(pipeline(chat_completion_stream_commit, retry_timeout, chunks_call), times=3),
+        "chat_completion_call",
+    )
 )
 
 chat_completion_no_stream_return_json = exception_handle(
-    retry(
-        pipeline(chat_completion_stream_commit, retry_timeout, chunks_content, content_to_json),
-        times=3,
+    fallback(
+        instrument(
+            retry(
+                pipeline(chat_completion_stream_commit, retry_timeout, chunks_json),
+                times=3,
+            ),
+            "chat_completion_no_stream_return_json",
+        )
     ),
     exception_output_handle(lambda err: None),
 )
 
-chat_completion_stream = exception_handle(
-    retry(
-        pipeline(
-            chat_completion_stream_commit,
-            retry_timeout,
-            chunks_content,
-            to_dict_content_and_call,
+
+def chat_completion_stream_return_json(messages: List[Dict], llm_config: Dict, on_item=None):
+    """
+    Like chat_completion_no_stream_return_json, but completed array items of the
+    response (e.g. each of {"test_cases": [...]}) are passed to on_item(key, item)
+    while the rest is still streaming. If an attempt is retried, on_item sees the
+    items of the new attempt again.
+    """
+    return exception_handle(
+        fallback(
+            instrument(
+                retry(
+                    pipeline(
+                        chat_completion_stream_commit,
+                        retry_timeout,
+                        partial(chunks_json, on_item=on_item),
+                    ),
+                    times=3,
+                ),
+                "chat_completion_stream_return_json",
+            )
         ),
-        times=3,
+        exception_output_handle(lambda err: None),
+    )(messages, llm_config=llm_config)
+
+
+chat_completion_stream = exception_handle(
+    fallback(
+        instrument(
+            retry(
+                pipeline(
+                    chat_completion_stream_commit,
+                    retry_timeout,
+                    chunks_content,
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "chat_completion_stream",
+        )
     ),
-    lambda err: {
-        "content": None,
-        "function_name": None,
-        "parameters": "",
-        "error": err.type if isinstance(err, openai.APIError) else err,
-    },
+    error_result,
 )
 
 chat_call_completion_stream = exception_handle(
-    retry(
-        pipeline(
-            chat_completion_stream_commit,
-            retry_timeout,
-            chunk_list,
-            parallel(chunks_content, chunks_call),
-            to_dict_content_and_call,
+    fallback(
+        instrument(
+            retry(
+                pipeline(
+                    chat_completion_stream_commit,
+                    retry_timeout,
+                    chunks_content_and_call,
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "chat_call_completion_stream",
+        )
+    ),
+    call_error_result,
+)
+
+
+def chat_call_completion_stream_dispatch(messages: List[Dict], llm_config: Dict, on_call=None):
+    """
+    Like chat_call_completion_stream, but each tool call is passed to
+    on_call(index, call) as soon as its arguments have streamed, so it can start
+    while the model is still generating. If an attempt is retried, on_call sees
+    the calls of the new attempt again.
+    """
+    return exception_handle(
+        fallback(
+            instrument(
+                retry(
+                    pipeline(
+                        chat_completion_stream_commit,
+                        retry_timeout,
+                        partial(chunks_content_and_call, on_call=on_call),
+                        to_dict_content_and_call,
+                    ),
+                    times=3,
+                ),
+                "chat_call_completion_stream_dispatch",
+            )
         ),
-        times=3,
+        call_error_result,
+    )(messages, llm_config=llm_config)
+
+
+achat_completion_stream = async_exception_handle(
+    afallback(
+        ainstrument(
+            async_retry(
+                async_pipeline(
+                    achat_completion_stream_commit,
+                    aretry_timeout,
+                    achunks_content,
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "achat_completion_stream",
+        )
+    ),
+    error_result,
+)
+
+achat_completion_no_stream_return_json = async_exception_handle(
+    afallback(
+        ainstrument(
+            async_retry(
+                async_pipeline(achat_completion_stream_commit, aretry_timeout, achunks_json),
+                times=3,
+            ),
+            "achat_completion_no_stream_return_json",
+        )
+    ),
+    exception_output_handle(lambda err: None),
+)
+
+achat_call_completion_stream = async_exception_handle(
+    afallback(
+        ainstrument(
+            async_retry(
+                async_pipeline(
+                    achat_completion_stream_commit,
+                    aretry_timeout,
+                    achunks_content_and_call,
+                    to_dict_content_and_call,
+                ),
+                times=3,
+            ),
+            "achat_call_completion_stream",
+        )
     ),
-    lambda err: {
-        "content": None,
-        "function_name": None,
-        "parameters": "",
-        "tool_calls": [],
-        "error": err.type if isinstance(err, openai.APIError) else err,
-    },
+    call_error_result,
 )
@@ -1,26 +1,180 @@
+import contextvars
+import email.utils
+import random
 import sys
-from typing import Dict
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
 
 import openai
 
+from .circuit import CircuitOpenError
+from .instrument import record_retry
+
 
 class RetryException(Exception):
     def __init__(self, err):
         self.error = err
 
 
-def retry(func, times):
+class RetryPolicy:
+    """
+    RetryPolicy decides whether and when a failed call is retried.
+
+    Errors are classified (rate_limit, timeout, connection, server, circuit_open,
+    invalid_output, other); each class has its own retry budget. Delays grow exponentially with
+    full jitter, server hints (Retry-After) take precedence, and the total time
+    spent retrying is capped by max_total_time.
+    """
+
+    TRANSIENT = ("rate_limit", "timeout", "connection", "server")
+
+    def __init__(
+        self,
+        max_attempts: Optional[int] = None,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        jitter: bool = True,
+        max_total_time: float = 120.0,
+        budgets: Optional[Dict[str, int]] = None,
+    ):
+        # max_attempts None means: use the `times` given to retry()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_total_time = max_total_time
+        # retries allowed per error class, unlisted classes share max_attempts
+        self.budgets = budgets or {}
+
+    def classify(self, err) -> str:
+        if isinstance(err, CircuitOpenError):
+            # not transient: retrying an open circuit only fails again
+            return "circuit_open"
+        if isinstance(err, openai.RateLimitError):
+            return "rate_limit"
+        if isinstance(err, openai.APITimeoutError):
+            return "timeout"
+        if isinstance(err, openai.APIConnectionError):
+            return "connection"
+        if isinstance(err, openai.InternalServerError):
+            return "server"
+        if isinstance(err, openai.APIStatusError) and err.status_code in (408, 409, 529):
+            return "server"
+        if isinstance(err, ValueError):
+            # json.JSONDecodeError and other malformed model outputs
+            return "invalid_output"
+        return "other"
+
+    def retry_after(self, err) -> Optional[float]:
+        """
+        Return the delay in seconds requested by the server, if any.
+        """
+        response = getattr(err, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            value = headers.get("retry-after")
+            if not value:
+                return None
+            try:
+                return float(value)
+            except ValueError:
+                retry_at = email.utils.parsedate_to_datetime(value)
+                return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt: int, kind: str, err) -> float:
+        if kind == "invalid_output":
+            return 0.0
+        hint = self.retry_after(err)
+        if hint is not None:
+            return hint
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def attempts(self, times: int) -> int:
+        return times if self.max_attempts is None else self.max_attempts
+
+
+_retry_policy = RetryPolicy()
+_retry_policy_override: contextvars.ContextVar = contextvars.ContextVar(
+    "retry_policy_override", default=None
+)
+
+
+def get_retry_policy() -> RetryPolicy:
+    return _retry_policy_override.get() or _retry_policy
+
+
+def set_retry_policy(policy: RetryPolicy):
+    """
+    Replace the default policy used by every retry() without an explicit policy.
+    """
+    global _retry_policy
+    _retry_policy = policy
+
+
+@contextmanager
+def retry_policy(policy: RetryPolicy):
+    """
+    Use policy for retry() calls made inside the with block (thread/task local).
+    """
+    token = _retry_policy_override.set(policy)
+    try:
+        yield policy
+    finally:
+        _retry_policy_override.reset(token)
+
+
+class RetryState:
+    """
+    Bookkeeping for one retried call, shared by retry and async_retry.
+    """
+
+    def __init__(self, times: int, policy: Optional[RetryPolicy] = None):
+        self.policy = policy or get_retry_policy()
+        self.max_attempts = self.policy.attempts(times)
+        self.attempt = 0
+        self.counts: Dict[str, int] = {}
+        self.started = time.monotonic()
+
+    def next_delay(self, exc: Exception) -> float:
+        """
+        Return how long to wait before the next attempt, or raise the error
+        if the call should not be retried.
+        """
+        err = exc.error if isinstance(exc, RetryException) else exc
+        kind = self.policy.classify(err)
+        if not isinstance(exc, RetryException) and kind not in RetryPolicy.TRANSIENT:
+            raise exc
+
+        self.attempt += 1
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        delay = self.policy.delay(self.attempt, kind, err)
+        elapsed = time.monotonic() - self.started
+        if (
+            self.attempt >= self.max_attempts
+            or self.counts[kind] > self.policy.budgets.get(kind, self.max_attempts - 1)
+            or elapsed + delay > self.policy.max_total_time
+        ):
+            raise err
+        record_retry(kind, delay, err)
+        return delay
+
+
+def retry(func, times, policy: Optional[RetryPolicy] = None):
     def wrapper(*args, **kwargs):
-        for index in range(times):
+        state = RetryState(times, policy)
+        while True:
             try:
                 return func(*args, **kwargs)
-            except RetryException as err:
-                if index + 1 == times:
-                    raise err.error
-                continue
             except Exception as err:
-                raise err
-        raise err.error
+                time.sleep(state.next_delay(err))
 
     return wrapper
 
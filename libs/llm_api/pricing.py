@@ -0,0 +1,35 @@
+from typing import Dict, Tuple
+
+# key is model name, value is (prompt_token_price, completion_token_price) in USD per 1K tokens
+PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "claude-2": (0.01102, 0.03268),
+    "starchat-alpha": (0.0004, 0.0004),
+    "CodeLlama-34b-Instruct": (0.0008, 0.0008),
+    "llama-2-70b-chat": (0.001, 0.001),
+    "gpt-3.5-turbo-1106": (0.001, 0.002),
+    "gpt-4-1106-preview": (0.01, 0.03),
+    "gpt-4-1106-vision-preview": (0.01, 0.03),
+    "gpt-4-turbo-preview": (0.01, 0.03),
+    # if model not in above list, use this price
+    "others": (0.001, 0.002),
+}
+
+
+def register_price(model: str, prompt_price: float, completion_price: float):
+    """
+    Register (or override) the USD price per 1K prompt/completion tokens of model.
+    """
+    PRICES[model] = (prompt_price, completion_price)
+
+
+def get_price(model: str) -> Tuple[float, float]:
+    return PRICES.get(model, PRICES["others"])
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = get_price(model)
+    return (prompt_price * prompt_tokens + completion_price * completion_tokens) / 1000
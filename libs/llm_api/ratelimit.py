@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from .client import current_endpoint
+from .file_lock import LockedJSONState
+
+DEFAULT_STATE_PATH = os.path.join(os.path.expanduser("~"), ".chat", "cache", "llm_rate_limit.json")
+
+
+def estimate_tokens(messages: List[Dict], llm_config: Dict) -> int:
+    """
+    Rough token estimate of a request: ~4 characters per prompt token plus the
+    completion budget (max_tokens, or a default guess).
+    """
+    chars = 0
+    for message in messages:
+        content = message.get("content") or ""
+        chars += len(content) if isinstance(content, str) else len(json.dumps(content))
+    if llm_config.get("tools"):
+        chars += len(json.dumps(llm_config["tools"]))
+    return chars // 4 + llm_config.get("max_tokens", 512)
+
+
+class RateLimiter:
+    """
+    RateLimiter is a token bucket limiter for requests/minute and tokens/minute.
+
+    Bucket state lives in a JSON file guarded by a file lock, so all workflow
+    processes using the same API key draw from the same buckets. acquire()
+    blocks until the request fits instead of failing it.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        path: str = DEFAULT_STATE_PATH,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._state = LockedJSONState(path)
+
+    @staticmethod
+    def _refill(bucket: Dict, capacity: int, now: float) -> float:
+        elapsed = max(0.0, now - bucket.get("ts", now))
+        return min(capacity, bucket.get("level", capacity) + elapsed * capacity / 60.0)
+
+    def try_acquire(self, scope: str, tokens: int) -> float:
+        """
+        Take one request and tokens from the buckets of scope.
+        Return 0 on success, otherwise the seconds to wait before trying again.
+        """
+        with self._state:
+            state = self._state.read()
+            buckets = state.setdefault(scope, {})
+            now = time.time()
+
+            wait = 0.0
+            levels = {}
+            for name, capacity, cost in (("requests", self.rpm, 1), ("tokens", self.tpm, tokens)):
+                if not capacity:
+                    continue
+                # a request larger than the whole bucket waits for a full bucket
+                cost = min(cost, capacity)
+                level = self._refill(buckets.get(name, {}), capacity, now)
+                levels[name] = (level, cost)
+                if level < cost:
+                    wait = max(wait, (cost - level) * 60.0 / capacity)
+
+            if wait > 0:
+                return wait
+            for name, (level, cost) in levels.items():
+                buckets[name] = {"level": level - cost, "ts": now}
+            self._state.write(state)
+            return 0.0
+
+    def acquire(self, scope: str, tokens: int):
+        while True:
+            wait = self.try_acquire(scope, tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, scope: str, tokens: int):
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, scope, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+def rate_limit_scope(api_key: Optional[str] = None, base_url: Optional[str] = None) -> str:
+    """
+    Bucket scope for a credential: processes sharing a key share the limits.
+    """
+    default_api_key, default_base_url = current_endpoint()
+    api_key = api_key or default_api_key or ""
+    base_url = base_url or default_base_url or ""
+    return hashlib.sha256(f"{base_url}|{api_key}".encode("utf-8")).hexdigest()[:16]
+
+
+_rate_limiter: Optional[RateLimiter] = None
+if os.environ.get("DEVCHAT_LLM_RPM") or os.environ.get("DEVCHAT_LLM_TPM"):
+    _rate_limiter = RateLimiter(
+        rpm=int(os.environ.get("DEVCHAT_LLM_RPM", "0")) or None,
+        tpm=int(os.environ.get("DEVCHAT_LLM_TPM", "0")) or None,
+    )
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    return _rate_limiter
+
+
+def set_rate_limiter(limiter: Optional[RateLimiter]):
+    """
+    Install (or, with None, remove) the limiter applied before every upstream call.
+    """
+    global _rate_limiter
+    _rate_limiter = limiter
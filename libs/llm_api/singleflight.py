@@ -0,0 +1,177 @@
+import os
+import threading
+from typing import Callable, Dict, Iterable, Optional
+
+
+class _Flight:
+    """
+    One upstream stream shared by every caller that asked for the same request.
+
+    Chunks are buffered as they arrive; each subscriber replays the buffer and then
+    pulls live chunks, whoever needs the next chunk first reads it from upstream.
+    Only that read waits on the network, subscribers replaying the buffer do not.
+    When the last subscriber closes before the stream ended, the flight is aborted:
+    the upstream stream is closed and no new caller joins it.
+    """
+
+    def __init__(self, create: Callable[[], Iterable], on_finish: Callable[["_Flight"], None]):
+        self._create = create
+        self._on_finish = on_finish
+        self._source = None
+        self._buffer = []
+        self._done = False
+        self._aborted = False
+        self._error: Optional[BaseException] = None
+        self._subscribers = 0
+        # guards the state below, _read_lock serializes the reads from upstream
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+
+    def join(self) -> bool:
+        """
+        Add a subscriber, return False if the flight was aborted.
+        """
+        with self._lock:
+            if self._aborted:
+                return False
+            self._subscribers += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self._subscribers -= 1
+            if self._subscribers or self._done or self._error is not None:
+                return
+            self._aborted = True
+            source = self._source
+        self._on_finish(self)
+        close = getattr(source, "close", None)
+        if close:
+            close()
+
+    def _ended(self, index: int) -> bool:
+        # called with self._lock held
+        if index < len(self._buffer):
+            return False
+        if self._error is not None:
+            raise self._error
+        return self._done or self._aborted
+
+    def get(self, index: int):
+        """
+        Return chunk index of the stream, raise StopIteration after the last one.
+        """
+        while True:
+            with self._lock:
+                if self._ended(index):
+                    raise StopIteration
+                if index < len(self._buffer):
+                    return self._buffer[index]
+            with self._read_lock:
+                with self._lock:
+                    if self._ended(index) or index < len(self._buffer):
+                        # another subscriber read it meanwhile
+                        continue
+                try:
+                    if self._source is None:
+                        self._source = iter(self._create())
+                    chunk = next(self._source)
+                except StopIteration:
+                    with self._lock:
+                        self._done = True
+                    self._on_finish(self)
+                    raise
+                except Exception as err:
+                    with self._lock:
+                        self._error = err
+                    self._on_finish(self)
+                    raise
+                with self._lock:
+                    self._buffer.append(chunk)
+                return chunk
+
+
+class _Subscription:
+    """
+    Iterator of one caller over a flight, closing it leaves the flight.
+    """
+
+    def __init__(self, flight: _Flight):
+        self._flight = flight
+        self._index = 0
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            chunk = self._flight.get(self._index)
+        except BaseException:
+            self.close()
+            raise
+        self._index += 1
+        return chunk
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._flight.leave()
+
+    def __del__(self):
+        self.close()
+
+
+class SingleFlight:
+    """
+    SingleFlight coalesces identical in-flight requests into one upstream call.
+
+    A request joins the flight with the same key while it is still streaming,
+    once the flight has finished (or was abandoned by all of its callers) the next
+    request with that key starts a new one.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def _finish(self, key: str, flight: _Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def do(self, key: str, create: Callable[[], Iterable]):
+        """
+        Return an iterator over the chunks of the flight for key, starting it
+        with create() if no identical request is in flight.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None or not flight.join():
+                flight = _Flight(create, lambda f: self._finish(key, f))
+                flight.join()
+                self._flights[key] = flight
+        return _Subscription(flight)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+
+_single_flight: Optional[SingleFlight] = None
+if os.environ.get("DEVCHAT_LLM_SINGLE_FLIGHT", "") in ("1", "true"):
+    _single_flight = SingleFlight()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    return _single_flight
+
+
+def set_single_flight(enabled: bool = True):
+    """
+    Enable or disable request coalescing for all pipelines.
+    """
+    global _single_flight
+    _single_flight = SingleFlight() if enabled else None
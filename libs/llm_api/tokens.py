@@ -0,0 +1,77 @@
+import json
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, fall back to a character estimate
+    tiktoken = None
+
+# per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=16)
+def get_encoding(encoding_name: str):
+    """
+    Get a tiktoken encoding by name, built with the pure python tokenizer if the
+    native one cannot be loaded.
+    """
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:
+        from tiktoken import registry
+        from tiktoken.core import Encoding
+        from tiktoken.registry import _find_constructors
+
+        _find_constructors()
+        constructor = registry.ENCODING_CONSTRUCTORS[encoding_name]
+        return Encoding(**constructor(), use_pure_python=True)
+
+
+@lru_cache(maxsize=16)
+def _encoding(model: Optional[str]):
+    """
+    Encoding of model, None if none can be loaded, e.g. offline. Failures are
+    cached too, so they are not retried for every message counted.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        from tiktoken.model import encoding_name_for_model
+
+        names = [encoding_name_for_model(model), "cl100k_base"]
+    except Exception:
+        names = ["cl100k_base"]
+    for name in names:
+        try:
+            return get_encoding(name)
+        except Exception:
+            continue
+    return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    Count the tokens of text, exactly with tiktoken if installed, else ~4 chars/token.
+    """
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    try:
+        return len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return (len(text) + 3) // 4
+
+
+def count_message_tokens(message: Dict, model: Optional[str] = None) -> int:
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return count_tokens(content, model) + MESSAGE_OVERHEAD
+
+
+def count_messages_tokens(messages: List[Dict], model: Optional[str] = None) -> int:
+    return sum(count_message_tokens(message, model) for message in messages)
@@ -0,0 +1,155 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+_MISSING = object()
+
+
+def arguments_key(arguments: Dict) -> str:
+    return json.dumps(arguments, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def invalidation_token(tool, arguments: Dict):
+    """
+    The current invalidation token of a call, e.g. the mtime of the file it reads.
+    A cached result is only reused while the token is unchanged.
+    """
+    cache_key = getattr(tool, "cache_key", None)
+    if cache_key is None:
+        return None
+    try:
+        return cache_key(**arguments)
+    except Exception:
+        # e.g. the file is gone: never match a cached entry
+        return _MISSING
+
+
+class ToolResultCache:
+    """
+    ToolResultCache memoizes results of tools declared cacheable with llm_func,
+    keyed by tool name and arguments. It is shared by all chat_tools sessions
+    of the process, bounded to max_entries (least recently used entries go
+    first) and entries expire after the tool's ttl.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, name: str, arguments: Dict, token=None, ttl: Optional[float] = None
+    ) -> Tuple[bool, Any]:
+        """
+        Return (True, result) for a fresh cached call, otherwise (False, None).
+        """
+        key = (name, arguments_key(arguments))
+        with self._lock:
+            entry = self._entries.get(key)
+            fresh = (
+                entry is not None
+                and token is not _MISSING
+                and entry["token"] == token
+                and (ttl is None or time.time() - entry["stored"] <= ttl)
+            )
+            if not fresh:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            entry["hits"] += 1
+            self.hits += 1
+            return True, entry["result"]
+
+    def put(self, name: str, arguments: Dict, result: Any, token=None):
+        if token is _MISSING:
+            return
+        key = (name, arguments_key(arguments))
+        with self._lock:
+            self._entries[key] = {
+                "result": result,
+                "token": token,
+                "stored": time.time(),
+                "hits": 0,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, name: Optional[str] = None):
+        """
+        Drop the cached results of tool name, or of every tool.
+        """
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == name]:
+                del self._entries[key]
+
+    def entries(self) -> List[Dict]:
+        """
+        Describe the cached calls, least recently used first.
+        """
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "name": name,
+                    "arguments": arguments,
+                    "age": now - entry["stored"],
+                    "hits": entry["hits"],
+                }
+                for (name, arguments), entry in self._entries.items()
+            ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+_tool_cache = ToolResultCache()
+
+
+def get_tool_cache() -> ToolResultCache:
+    return _tool_cache
+
+
+def set_tool_cache(cache: ToolResultCache):
+    """
+    Replace the process-wide tool result cache, e.g. with a differently sized one.
+    """
+    global _tool_cache
+    _tool_cache = cache
+
+
+def call_cached(tool, arguments: Dict):
+    """
+    Call a sync tool, reusing the cached result if the tool is cacheable.
+    """
+    if not getattr(tool, "cacheable", False):
+        return tool(**arguments)
+    cache = get_tool_cache()
+    token = invalidation_token(tool, arguments)
+    hit, result = cache.get(tool.function_name, arguments, token, tool.cache_ttl)
+    if not hit:
+        result = tool(**arguments)
+        cache.put(tool.function_name, arguments, result, token)
+    return result
+
+
+async def acall_cached(tool, arguments: Dict):
+    if not getattr(tool, "cacheable", False):
+        return await tool(**arguments)
+    cache = get_tool_cache()
+    token = invalidation_token(tool, arguments)
+    hit, result = cache.get(tool.function_name, arguments, token, tool.cache_ttl)
+    if not hit:
+        result = await tool(**arguments)
+        cache.put(tool.function_name, arguments, result, token)
+    return result
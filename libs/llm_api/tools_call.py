@@ -1,16 +1,26 @@
+import asyncio
+import inspect
 import json
 import os
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from functools import wraps
+from typing import Dict, List, Optional, Tuple
 
+from .compaction import ContextPolicy
 from .memory.base import ChatMemory
-from .openai import chat_call_completion_stream
+from .openai import chat_call_completion_stream, chat_call_completion_stream_dispatch
+from .tool_cache import acall_cached, arguments_key, call_cached
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from chatmark import Checkbox, Form, Radio, TextEditor  # noqa: #402
 from ide_services import IDEService  # noqa: #402
 
+# how many tool calls of one model response run at the same time
+TOOL_CONCURRENCY = int(os.environ.get("DEVCHAT_LLM_TOOL_CONCURRENCY", "4"))
+
 
 class MissToolsFieldException(Exception):
     pass
@@ -35,11 +45,49 @@ def openai_function_schema(name, description, properties, required):
     }
 
 
-def llm_func(name, description, schema_fun=openai_tool_schema):
-    def decorator(func):
+def _passthrough(func):
+    # keep async tools awaitable through the decorators
+    if inspect.iscoroutinefunction(func):
+
         @wraps(func)
-        def wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
+        async def async_wrapper(*args, **kwargs):
+            return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def llm_func(
+    name,
+    description,
+    schema_fun=openai_tool_schema,
+    cacheable: bool = False,
+    ttl: Optional[float] = None,
+    cache_key=None,
+    idempotent: bool = False,
+):
+    """
+    Register func as a tool. A cacheable tool is pure: chat_tools reuses its
+    result for repeated calls with the same arguments (see ToolResultCache)
+    until ttl seconds have passed or cache_key(**arguments), e.g. the mtime of
+    the file the tool reads, returns another value.
+
+    An idempotent tool (cacheable ones are) may run more than once for one
+    call, so chat_tools(stream_tools=True) starts it while the response is
+    still streaming.
+    """
+
+    def decorator(func):
+        wrapper = _passthrough(func)
+        wrapper.cacheable = cacheable
+        wrapper.idempotent = idempotent or cacheable
+        wrapper.cache_ttl = ttl
+        wrapper.cache_key = cache_key
 
         if not hasattr(func, "llm_metadata"):
             func.llm_metadata = {"properties": {}, "required": []}
@@ -58,9 +106,7 @@ def llm_func(name, description, schema_fun=openai_tool_schema):
 
 def llm_param(name, description, dtype, **kwargs):
     def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
+        wrapper = _passthrough(func)
 
         if hasattr(func, "llm_metadata"):
             wrapper.llm_metadata = func.llm_metadata
@@ -132,88 +178,278 @@ def call_confirm(response):
     return prompt_user_confirmation()
 
 
+class ToolDispatcher:
+    """
+    ToolDispatcher starts tool calls as soon as they are submitted and hands
+    back their results in call order.
+
+    Sync tools run in a thread pool, async tools (async def functions registered
+    with llm_func) on an event loop in a background thread; at most
+    max_concurrency calls of each kind run at once. Submitting the same call
+    (index, name and arguments) again reuses the running one, so a retried
+    stream does not start its tools twice.
+
+    prefetch() starts calls of a response that is still streaming. A stream
+    that fails is retried and may ask for other calls, so prefetched calls
+    run at least once and possibly without their result being used; only
+    idempotent tools are prefetched, the others start in results().
+    """
+
+    def __init__(self, tools, max_concurrency: int = TOOL_CONCURRENCY):
+        self._functions = {tool.function_name: tool for tool in tools}
+        self._max_concurrency = max(1, max_concurrency)
+        self._futures: Dict[Tuple, Future] = {}
+        self._cached_calls: Dict[Tuple, Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @staticmethod
+    def _log_call(call: Dict):
+        IDEService().ide_logging(
+            "info",
+            f"try to call function tool: {call['function_name']} with {call['parameters']}",
+        )
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+            self._loop_thread.start()
+        return self._loop
+
+    async def _limited(self, tool, arguments):
+        if self._semaphore is None:
+            # created on the loop it is used on
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        async with self._semaphore:
+            return await acall_cached(tool, arguments)
+
+    def _start(self, call: Dict) -> Future:
+        self._log_call(call)
+        try:
+            tool = self._functions[call["function_name"]]
+            arguments = json.loads(call["parameters"] or "{}")
+        except Exception as err:
+            # reported by results(), not inside the stream that submitted the call
+            future = Future()
+            future.set_exception(err)
+            return future
+
+        if getattr(tool, "cacheable", False):
+            # identical calls of a pure tool in one response run once
+            same_call = (call["function_name"], arguments_key(arguments))
+            if same_call in self._cached_calls:
+                return self._cached_calls[same_call]
+        if inspect.iscoroutinefunction(tool):
+            future = asyncio.run_coroutine_threadsafe(
+                self._limited(tool, arguments), self._event_loop()
+            )
+        else:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_concurrency)
+            future = self._executor.submit(call_cached, tool, arguments)
+        if getattr(tool, "cacheable", False):
+            self._cached_calls[same_call] = future
+        return future
+
+    def prefetch(self, index: int, call: Dict):
+        tool = self._functions.get(call["function_name"])
+        if getattr(tool, "idempotent", False):
+            self.submit(index, call)
+
+    def submit(self, index: int, call: Dict) -> Future:
+        key = (index, call["function_name"], call["parameters"])
+        if key not in self._futures:
+            self._futures[key] = self._start(call)
+        return self._futures[key]
+
+    def results(self, calls: List[Dict]) -> List:
+        """
+        Wait for calls (starting those not submitted yet) and return their
+        results in call order. The first failing call, in call order, raises
+        its error. Afterwards the dispatcher is ready for the next response.
+        """
+        try:
+            if len(calls) == 1 and not self._futures:
+                tool = self._functions.get(calls[0]["function_name"])
+                if tool is not None and not inspect.iscoroutinefunction(tool):
+                    # nothing to overlap with, run in the caller's thread
+                    self._log_call(calls[0])
+                    return [call_cached(tool, json.loads(calls[0]["parameters"] or "{}"))]
+
+            futures = [self.submit(index, call) for index, call in enumerate(calls)]
+            wait(futures)
+            for future in futures:
+                if future.exception() is not None:
+                    raise future.exception()
+            return [future.result() for future in futures]
+        finally:
+            self._futures = {}
+            self._cached_calls = {}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop = None
+
+    def __enter__(self) -> "ToolDispatcher":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def run_tool_calls(calls: List[Dict], tools, max_concurrency: int = TOOL_CONCURRENCY) -> List:
+    """
+    Execute the tool calls of one model response concurrently and return their
+    results in call order (see ToolDispatcher).
+    """
+    with ToolDispatcher(tools, max_concurrency) as dispatcher:
+        return dispatcher.results(calls)
+
+
+def _describe_calls(response) -> str:
+    calls = response.get("all_calls") or [
+        {
+            "function_name": response.get("function_name", ""),
+            "parameters": response.get("parameters", ""),
+        }
+    ]
+    return "\n".join(
+        f"call function {call['function_name']} with arguments:{call['parameters']}"
+        for call in calls
+    )
+
+
+def _loop_limit(policy: ContextPolicy, iterations: int, spent_tokens: int) -> Optional[str]:
+    if policy.max_iterations and iterations > policy.max_iterations:
+        return f"reached max_iterations ({policy.max_iterations})"
+    if policy.max_total_tokens and spent_tokens > policy.max_total_tokens:
+        return f"reached max_total_tokens ({policy.max_total_tokens})"
+    return None
+
+
 def chat_tools(
     prompt,
     memory: ChatMemory = None,
     model: str = os.environ.get("LLM_MODEL", "gpt-3.5-turbo-1106"),
     tools=None,
     call_confirm_fun=call_confirm,
+    max_tool_concurrency: int = TOOL_CONCURRENCY,
+    stream_tools: bool = False,
+    context_policy: Optional[ContextPolicy] = None,
     **llm_config,
 ):
+    """
+    With stream_tools, each call of an idempotent tool (see llm_func) starts as
+    soon as its arguments have streamed instead of after the whole response.
+    This needs call_confirm_fun=None, since a call cannot be confirmed before it
+    has run.
+
+    context_policy, e.g. ContextPolicy(), compacts the growing messages before
+    each model call and bounds the iterations and tokens of the loop. Without it
+    the messages are sent as they are and only the number of model calls is
+    bounded, by DEVCHAT_LLM_MAX_ITERATIONS (30 by default).
+
+    Like chat, the decorated function is reentrant and may run from several threads.
+    """
+    if stream_tools and call_confirm_fun:
+        raise ValueError("stream_tools=True needs call_confirm_fun=None")
+
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            nonlocal prompt, memory, model, tools, call_confirm_fun, llm_config
-            prompt = prompt.format(**kwargs)
+            user_prompt = prompt.format(**kwargs)
             if not tools:
                 raise MissToolsFieldException()
 
             messages = memory.contexts() if memory else []
-            if not any(item["content"] == prompt for item in messages):
-                messages.append({"role": "user", "content": prompt})
+            if not (memory and memory.contains(user_prompt)):
+                messages.append({"role": "user", "content": user_prompt})
 
             tool_schemas = [fun.json_schema() for fun in tools] if tools else []
-
-            llm_config["model"] = model
-            llm_config["tools"] = tool_schemas
-
-            user_request = {"role": "user", "content": prompt}
-            while True:
-                response = chat_call_completion_stream(messages, llm_config=llm_config)
-                if not response.get("content", None) and not response.get("function_name", None):
-                    print(f"call {func.__name__} failed:", response["error"], file=sys.stderr)
-                    return response
-
-                response_content = (
-                    f"{response.get('content', '') or ''}\n\n"
-                    f"call function {response.get('function_name', '')} with arguments:"
-                    f"{response.get('parameters', '')}"
-                )
-                if memory:
-                    memory.append(user_request, {"role": "assistant", "content": response_content})
-                messages.append({"role": "assistant", "content": response_content})
-
-                if not response.get("function_name", None):
-                    return response
-                if not response.get("all_calls", None):
-                    response["all_calls"] = [
-                        {
-                            "function_name": response["function_name"],
-                            "parameters": response["parameters"],
-                        }
-                    ]
-
-                do_call = True
-                if call_confirm_fun:
-                    do_call, fix_prompt = call_confirm_fun(response)
-
-                if do_call:
-                    # call function
-                    functions = {tool.function_name: tool for tool in tools}
-                    for call in response["all_calls"]:
-                        IDEService().ide_logging(
-                            "info",
-                            f"try to call function tool: {call['function_name']} "
-                            f"with {call['parameters']}",
+            config = {**llm_config, "model": model, "tools": tool_schemas}
+
+            user_request = {"role": "user", "content": user_prompt}
+            # without a policy: no compaction, only the default iteration cap
+            policy = context_policy or ContextPolicy(max_context_tokens=None)
+            pinned = [item for item in messages if item["content"] == user_prompt][:1]
+            iterations = 0
+            spent_tokens = 0
+            response = {"content": None, "function_name": None, "parameters": ""}
+            with ToolDispatcher(tools, max_tool_concurrency) as dispatcher:
+                while True:
+                    iterations += 1
+                    messages = policy.compact(messages, model, pinned)
+                    if policy.max_total_tokens:
+                        spent_tokens += policy.count_all(messages, model)
+                    limit = _loop_limit(policy, iterations, spent_tokens)
+                    if limit:
+                        print(f"call {func.__name__} stopped: {limit}", file=sys.stderr)
+                        return {**response, "error": limit}
+
+                    if stream_tools:
+                        response = chat_call_completion_stream_dispatch(
+                            messages, llm_config=config, on_call=dispatcher.prefetch
+                        )
+                    else:
+                        response = chat_call_completion_stream(messages, llm_config=config)
+                    if not (response.get("content") or response.get("function_name")):
+                        print(f"call {func.__name__} failed:", response["error"], file=sys.stderr)
+                        return response
+
+                    response_content = (
+                        f"{response.get('content', '') or ''}\n\n{_describe_calls(response)}"
+                    )
+                    if policy.max_total_tokens:
+                        spent_tokens += policy.count({"content": response_content}, model)
+                    if memory:
+                        memory.append(
+                            user_request, {"role": "assistant", "content": response_content}
                         )
-                        tool = functions[call["function_name"]]
-                        result = tool(**json.loads(call["parameters"]))
-                        messages.append(
+                    messages.append({"role": "assistant", "content": response_content})
+
+                    if not response.get("function_name", None):
+                        return response
+                    if not response.get("all_calls", None):
+                        response["all_calls"] = [
                             {
+                                "function_name": response["function_name"],
+                                "parameters": response["parameters"],
+                            }
+                        ]
+
+                    do_call = True
+                    if call_confirm_fun:
+                        do_call, fix_prompt = call_confirm_fun(response)
+
+                    if do_call:
+                        # call functions, results are appended in call order
+                        results = dispatcher.results(response["all_calls"])
+                        for call, result in zip(response["all_calls"], results):
+                            messages.append(
+                                {
+                                    "role": "function",
+                                    "content": f"function has called, this is the result: {result}",
+                                    "name": call["function_name"],
+                                }
+                            )
+                            user_request = {
                                 "role": "function",
                                 "content": f"function has called, this is the result: {result}",
                                 "name": call["function_name"],
                             }
-                        )
-                        user_request = {
-                            "role": "function",
-                            "content": f"function has called, this is the result: {result}",
-                            "name": call["function_name"],
-                        }
-                else:
-                    # update prompt
-                    messages.append({"role": "user", "content": fix_prompt})
-                    user_request = {"role": "user", "content": fix_prompt}
+                    else:
+                        # update prompt
+                        messages.append({"role": "user", "content": fix_prompt})
+                        user_request = {"role": "user", "content": fix_prompt}
 
         return wrapper
 
@@ -1,10 +1,12 @@
 import json
+import sys
 from pathlib import Path
 from typing import Callable, List
 
 from assistants.directory_structure.base import DirectoryStructureBase
 from assistants.rerank_files import rerank_files
 from devchat.llm.openai import chat_completion_no_stream_return_json
+from llm_api.batch import run_batch
 from llm_conf import (
     CONTEXT_SIZE,
     DEFAULT_CONTEXT_SIZE,
@@ -23,6 +25,7 @@ ENCODING = (
     else get_encoding("cl100k_base")
 )
 TOKEN_BUDGET = int(CONTEXT_SIZE.get(MODEL, DEFAULT_CONTEXT_SIZE) * 0.95)
+MAX_CONCURRENCY = 4
 
 
 class RelevantFileFinder(DirectoryStructureBase):
@@ -89,38 +92,51 @@ class RelevantFileFinder(DirectoryStructureBase):
 
         return message
 
-    def _find_relevant_files(self, objective: str, dir_structure_pages: List[str]) -> List[str]:
-        files: List[str] = []
-        for dir_structure in dir_structure_pages:
-            user_msg = self._mk_message(objective, dir_structure)
-
-            json_res = {}
-            if USE_USER_MODEL:
-                # Use the wrapped api parameters
-                json_res = (
-                    chat_completion_no_stream_return_json(
-                        messages=[{"role": "user", "content": user_msg}],
-                        llm_config={
-                            "model": MODEL,
-                            "temperature": 0.1,
-                        },
-                    )
-                    or {}
-                )
-
-            else:
-                # Use the openai api parameters
-                response = create_chat_completion_content(
-                    model=MODEL,
-                    messages=[
-                        {"role": "user", "content": user_msg},
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=0.1,
+    def _find_relevant_files_in_page(self, objective: str, dir_structure: str) -> List[str]:
+        user_msg = self._mk_message(objective, dir_structure)
+
+        json_res = {}
+        if USE_USER_MODEL:
+            # Use the wrapped api parameters
+            json_res = (
+                chat_completion_no_stream_return_json(
+                    messages=[{"role": "user", "content": user_msg}],
+                    llm_config={
+                        "model": MODEL,
+                        "temperature": 0.1,
+                    },
                 )
-                json_res = json.loads(response)
+                or {}
+            )
+
+        else:
+            # Use the openai api parameters
+            response = create_chat_completion_content(
+                model=MODEL,
+                messages=[
+                    {"role": "user", "content": user_msg},
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.1,
+            )
+            json_res = json.loads(response)
+
+        return json_res.get("files", [])
+
+    @staticmethod
+    def _page_failed(err) -> List[str]:
+        print(f"Failed to find relevant files in a page: {err}", file=sys.stderr, flush=True)
+        return []
 
-            files.extend(json_res.get("files", []))
+    def _find_relevant_files(self, objective: str, dir_structure_pages: List[str]) -> List[str]:
+        # Pages are independent, query them concurrently
+        page_files = run_batch(
+            lambda page: self._find_relevant_files_in_page(objective, page),
+            dir_structure_pages,
+            max_concurrency=MAX_CONCURRENCY,
+            error_handler=self._page_failed,
+        )
+        files: List[str] = [f for page in page_files for f in page]
 
         reranked = rerank_files(
             question=objective,
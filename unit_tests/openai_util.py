@@ -1,6 +1,6 @@
-import os
 from typing import Optional
 
+from llm_api.client import get_client
 from openai import OpenAI, Stream
 from openai.types.chat import ChatCompletionChunk
 from tenacity import retry, stop_after_attempt, wait_random_exponential
@@ -14,10 +14,7 @@ def create_chat_completion_chunks(
     """
     Create streaming responses.
     """
-    _client = client or OpenAI(
-        api_key=os.environ.get("OPENAI_API_KEY", None),
-        base_url=os.environ.get("OPENAI_API_BASE", None),
-    )
+    _client = client or get_client()
 
     # Force to use streaming
     kwargs["stream"] = True
@@ -40,10 +37,7 @@ def create_chat_completion_content(client: Optional[OpenAI] = None, **kwargs) ->
 
     This is a replacement of creating non-streaming chat completion.
     """
-    _client = client or OpenAI(
-        api_key=os.environ.get("OPENAI_API_KEY", None),
-        base_url=os.environ.get("OPENAI_API_BASE", None),
-    )
+    _client = client or get_client()
 
     # Force to use streaming
     kwargs["stream"] = True